@@ -0,0 +1,80 @@
+"""
+Microbenchmark for the compiled per class hydrate and save plans.
+
+Compares CoreDBO.hydrate and save_value against the previous implementation, which looped over dbo_fields and
+signalled unchanged defaults by raising KeyError.  Run from the repository root:
+
+    python bench/dbo_plans.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lampost.db.dbo import CoreDBO
+from lampost.db.dbofield import DBOField, save_value_refs
+
+
+def legacy_hydrate(dbo, dto):
+    for field, dbo_field in dbo.dbo_fields.items():
+        if field in dto:
+            dbo_field.hydrate(dbo, dto[field])
+        else:
+            try:
+                delattr(dbo, field)
+            except AttributeError:
+                pass
+
+
+def legacy_save_value(dbo):
+    save_value = {}
+    for field, dbo_field in dbo.dbo_fields.items():
+        try:
+            save_value[field] = dbo_field.save_value(dbo)
+        except KeyError:
+            continue
+    return save_value
+
+
+class BenchChild(CoreDBO):
+    class_id = 'bench_child'
+    name = DBOField('')
+    count = DBOField(0)
+
+
+# 30 fields: 20 scalars, 5 collections and 5 child object collections.  Typical stored objects only
+# override a minority of their defaults.
+fields = {'scalar_{}'.format(ix): DBOField(ix) for ix in range(20)}
+fields.update({'list_{}'.format(ix): DBOField([]) for ix in range(5)})
+fields.update({'children_{}'.format(ix): DBOField([], 'bench_child') for ix in range(5)})
+BenchDBO = type('BenchDBO', (CoreDBO,), dict(fields, class_id='bench_dbo'))
+
+dto = {'scalar_{}'.format(ix): ix * 10 for ix in range(0, 20, 3)}
+dto.update({'list_0': [1, 2, 3], 'list_3': ['a']})
+dto.update({'children_1': [{'name': 'one', 'count': 1}, {'name': 'two'}]})
+
+
+def run(label, func, number):
+    elapsed = min(timeit.repeat(func, number=number, repeat=5))
+    print("{:<20}{:>10.2f} us".format(label, elapsed / number * 1000000))
+    return elapsed
+
+
+def main(number=20000):
+    dbo = BenchDBO()
+    dbo.hydrate(dto)
+    save_value_refs.current = []
+    assert legacy_save_value(dbo) == dbo.save_value
+
+    print("{} fields, {} iterations".format(len(BenchDBO.dbo_fields), number))
+    old = run('legacy hydrate', lambda: legacy_hydrate(dbo, dto), number)
+    new = run('plan hydrate', lambda: dbo._dbo_hydrate(dto), number)
+    print("hydrate speedup     {:>10.2f}x".format(old / new))
+    old = run('legacy save', lambda: legacy_save_value(dbo), number)
+    new = run('plan save', lambda: dbo._dbo_save_value(), number)
+    print("save speedup        {:>10.2f}x".format(old / new))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,103 @@
+"""
+Benchmark for the PulseDispatcher timing wheel with a large number of active timers.
+
+Compares PulseDispatcher against the previous implementation, which kept a set of registrations for each
+absolute pulse and sorted the set by priority every tick.  The scheduled column counts registrations still held
+after a tenth of the timers are unregistered.  Registrations repeat every 1 to 60 seconds at 10
+pulses per second with a few distinct priorities, like mob and regeneration timers.  Run from the repository
+root:
+
+    python bench/pulse_wheel.py [timers] [pulses]
+"""
+import os
+import random
+import sys
+import time
+
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lampost.di.resource import register
+from lampost.util.logging import LogFactory
+
+register('log', LogFactory())
+
+from lampost.event.dispatcher import Dispatcher, PulseDispatcher
+from lampost.event.registration import PulseRegistration
+
+
+class LegacyPulseDispatcher(Dispatcher):
+    def __init__(self, pulses_per_second=10, start_pulse=0):
+        super().__init__()
+        self._pulse_map = defaultdict(set)
+        self.pulses_per_second = pulses_per_second
+        self.current_pulse = start_pulse
+
+    def register_p(self, callback, pulses=0, randomize=0, priority=0, repeat=True):
+        if randomize:
+            randomize = random.randint(0, randomize)
+        registration = PulseRegistration(pulses, callback, priority=priority, repeat=repeat)
+        registration.cancel = lambda: setattr(registration, 'freq', 0)
+        self._pulse_map[self.current_pulse + randomize + pulses].add(registration)
+        return self._add_registration(registration)
+
+    def pulse(self):
+        self.dispatch('pulse')
+        for reg in sorted(self._pulse_map[self.current_pulse], key=lambda reg: reg.priority):
+            if reg.freq:
+                try:
+                    reg.callback(**reg.kwargs)
+                except Exception:
+                    pass
+            if reg.repeat:
+                self._pulse_map[self.current_pulse + reg.freq].add(reg)
+        del self._pulse_map[self.current_pulse]
+        self.current_pulse += 1
+
+
+def callback():
+    pass
+
+
+def scheduled(dispatcher):
+    if isinstance(dispatcher, LegacyPulseDispatcher):
+        return sum(len(regs) for regs in dispatcher._pulse_map.values())
+    return len(dispatcher._wheel)
+
+
+def run(label, dispatcher, timers, pulses):
+    random.seed(42)
+    rand = random.Random(42)
+    start = time.perf_counter()
+    regs = [dispatcher.register_p(callback, pulses=rand.randint(10, 600), randomize=rand.randint(0, 600),
+                                  priority=rand.randint(0, 3)) for _ in range(timers)]
+    register_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(pulses):
+        dispatcher.pulse()
+    pulse_time = time.perf_counter() - start
+
+    cancel = rand.sample(regs, timers // 10)
+    start = time.perf_counter()
+    for reg in cancel:
+        dispatcher.unregister(reg)
+    cancel_time = time.perf_counter() - start
+
+    print("{:<10}{:>12.2f}{:>12.2f}{:>12.2f}{:>12}".format(label, register_time / timers * 1000000,
+                                                           pulse_time / pulses * 1000,
+                                                           cancel_time / len(cancel) * 1000000, scheduled(dispatcher)))
+    return pulse_time
+
+
+def main(timers=100000, pulses=3000):
+    print("{} timers, {} pulses".format(timers, pulses))
+    print("{:<10}{:>12}{:>12}{:>12}{:>12}".format('', 'register us', 'pulse ms', 'cancel us', 'scheduled'))
+    old = run('legacy', LegacyPulseDispatcher(), timers, pulses)
+    new = run('wheel', PulseDispatcher(), timers, pulses)
+    print("pulse speedup {:.2f}x".format(old / new))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,79 @@
+"""
+Benchmark for broadcasting a channel message to many sessions.
+
+Compares appending the message dictionary to every session, which encodes it again in every session flush, with
+an OutputFragment encoded once and spliced into each session's output.  Each session also has a line of its own
+output queued, like the display output of an active player.  Times cover appending the message and one flush
+pulse.  Run from the repository root:
+
+    python bench/session_fanout.py [sessions] [pulses]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lampost.di.resource import register
+from lampost.util.logging import LogFactory
+
+register('log', LogFactory())
+register('json_encode', json.JSONEncoder().encode)
+
+from lampost.event.dispatcher import PulseDispatcher
+
+register('dispatcher', PulseDispatcher())
+
+from lampost.server import session as sm
+
+
+class NullSocket:
+    def __init__(self):
+        self.sent = 0
+
+    def write_message(self, message):
+        self.sent += len(message)
+
+
+def message(ix):
+    return {'channel': {'id': 'shout', 'text': 'Player{}: the dragon is in the east tower, bring potions'.format(ix),
+                        'timestamp': 1476000000 + ix}}
+
+
+def run(label, sessions, pulses, send):
+    sent = 0
+    start = time.perf_counter()
+    for ix in range(pulses):
+        for session in sessions:
+            session.display_line({'text': 'You hear a distant roar.', 'display': 'default'})
+        send(sessions, message(ix))
+        sm.flush_scheduler.flush()
+    elapsed = time.perf_counter() - start
+    for session in sessions:
+        sent += session.socket.sent
+        session.socket.sent = 0
+    print("{:<10}{:>12.2f}{:>12}".format(label, elapsed / pulses * 1000, sent // pulses))
+    return elapsed
+
+
+def append_each(sessions, data):
+    for session in sessions:
+        session.append(data)
+
+
+def main(count=5000, pulses=50):
+    sessions = []
+    for _ in range(count):
+        session = sm.AppSession().attach()
+        session.attach_socket(NullSocket())
+        sessions.append(session)
+    print("{} sessions, {} pulses".format(count, pulses))
+    print("{:<10}{:>12}{:>12}".format('', 'pulse ms', 'bytes'))
+    old = run('append', sessions, pulses, append_each)
+    new = run('fragment', sessions, pulses, sm.broadcast)
+    print("pulse speedup {:.2f}x".format(old / new))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
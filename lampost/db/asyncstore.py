@@ -0,0 +1,391 @@
+import asyncio
+import importlib
+import time
+
+from collections import deque
+
+from redis import BlockingConnectionPool
+from redis.exceptions import ConnectionError, NoScriptError
+
+from lampost.di.resource import Injected, module_inject
+from lampost.db.registry import get_dbo_class
+from lampost.db.exceptions import ObjectExistsError
+from lampost.db.redisstore import split_key, IX_UPDATE_SCRIPT, PoolGauges
+from lampost.db.counter import counter_key
+
+log = Injected('log')
+json_encode = Injected('json_encode')
+json_decode = Injected('json_decode')
+module_inject(__name__)
+
+
+def async_datastore(store):
+    """
+    Returns the awaitable interface for a datastore.  A store without a Redis server, or a server without an
+    asyncio client library, gets an InlineAsyncStore.
+    """
+    if not hasattr(store.pool, 'connection_kwargs'):
+        return InlineAsyncStore(store)
+    try:
+        return AsyncRedisStore(store)
+    except RuntimeError as exp:
+        log.warn("{}, falling back to blocking datastore calls", exp)
+        return InlineAsyncStore(store)
+
+
+class AsyncRedisStore:
+    """
+    Awaitable companion to a RedisStore.  It shares the store's object map, cache and hydration logic, but all
+    Redis traffic goes through an asyncio client so a slow reply never blocks the IOLoop.  Requires a redis
+    client library that provides redis.asyncio.
+    """
+
+    def __init__(self, store):
+        try:
+            aioredis = importlib.import_module('redis.asyncio')
+        except ImportError:
+            raise RuntimeError("Asynchronous datastore requires a redis package with asyncio support")
+        if not hasattr(store.pool, 'connection_kwargs'):
+            raise RuntimeError("Asynchronous datastore requires a Redis server")
+        self.store = store
+        self.pool = _async_pool(aioredis, store.pool)
+        self.raw_pool = _async_pool(aioredis, store.raw_pool)
+        self.redis = aioredis.StrictRedis(connection_pool=self.pool)
+        self.raw_redis = aioredis.StrictRedis(connection_pool=self.raw_pool)
+        self._loader = DBOLoader(self)
+
+    async def load_object(self, dbo_key, key_type=None, silent=False):
+        try:
+            dbo_key, key_type, dbo_id = split_key(dbo_key, key_type)
+        except TypeError:
+            if not silent:
+                log.exception("Invalid dbo_key passed to load_object", stack_info=True)
+            return
+        dbo = self.store.load_cached(dbo_key)
+        if dbo:
+            self.store.dbo_cache.touch(dbo_key, dbo)
+            return dbo
+        dbo = await self._loader.load(dbo_key)
+        if not dbo and not silent:
+            log.warn("Failed to find {} in database", dbo_key)
+        return dbo
+
+    async def load_objects(self, dbo_keys):
+        return await asyncio.gather(*(self.load_object(dbo_key, silent=True) for dbo_key in dbo_keys))
+
+    async def load_object_set(self, dbo_class, set_key=None):
+        results = set()
+        async for dbo in self.iter_object_set(dbo_class, set_key):
+            results.add(dbo)
+        return results
+
+    def iter_object_set(self, dbo_class, set_key=None, chunk_size=500):
+        """
+        Asynchronous iterator over the objects in a set, read with SSCAN and loaded chunk_size at a time as in
+        RedisStore.iter_object_set
+        """
+        dbo_class = get_dbo_class(getattr(dbo_class, 'dbo_key_type', dbo_class))
+        return ObjectSetIterator(self, dbo_class.dbo_key_type, set_key or dbo_class.dbo_set_key, chunk_size)
+
+    async def create_object(self, dbo_class, dbo_dict, update_timestamp=True):
+        dbo_class = get_dbo_class(getattr(dbo_class, 'dbo_key_type', dbo_class))
+        if not dbo_class:
+            return
+        try:
+            dbo_id = dbo_dict['dbo_id']
+        except KeyError:
+            dbo_id, dbo_dict = dbo_dict, {}
+        if dbo_id is None or dbo_id == '':
+            log.warn("create_object called with empty dbo_id")
+            return
+        dbo_id = str(dbo_id).lower()
+        if await self.object_exists(dbo_class.dbo_key_type, dbo_id):
+            raise ObjectExistsError(dbo_id)
+        dbo = dbo_class()
+        dbo.dbo_id = dbo_id
+        dbo.hydrate(dbo_dict)
+        dbo._dbo_ix = {}
+        dbo._dbo_refs = frozenset()
+        dbo.db_created()
+        pipeline = self.redis.pipeline()
+        if dbo.dbo_set_key:
+            pipeline.sadd(dbo.dbo_set_key, dbo.dbo_id)
+        await self._execute_saves(pipeline, [await self._queue_save(dbo, pipeline, update_timestamp)])
+        return dbo
+
+    async def save_object(self, dbo, update_timestamp=False, autosave=False, force=False):
+        self.store.write_queue.discard(dbo.dbo_key)
+        if force:
+            dbo.__dict__.pop('_dbo_digest', None)
+        pipeline = self.redis.pipeline()
+        await self._execute_saves(pipeline, [await self._queue_save(dbo, pipeline, update_timestamp)])
+        log.debug("db object {} {}saved", dbo.dbo_key, "auto" if autosave else "")
+        return dbo
+
+    async def update_object(self, dbo, dbo_dict):
+        dbo.hydrate(dbo_dict)
+        return await self.save_object(dbo, True)
+
+    async def object_exists(self, obj_type, obj_id):
+        return await self.redis.exists('{}:{}'.format(obj_type, obj_id))
+
+    async def load_value(self, key, default=None):
+        raw_value = await self.raw_redis.get(key)
+        if raw_value:
+            return self.store._decode_value(key, raw_value)
+        return default
+
+    async def save_value(self, key, value):
+        await self.redis.set(key, json_encode(value))
+
+    async def fetch_set_keys(self, set_key):
+        return await self.redis.smembers(set_key)
+
+    async def add_set_key(self, set_key, *values):
+        await self.redis.sadd(set_key, *values)
+
+    async def delete_set_key(self, set_key, value):
+        await self.redis.srem(set_key, value)
+
+    async def set_key_exists(self, set_key, value):
+        return await self.redis.sismember(set_key, value)
+
+    async def db_counter(self, counter_id, inc=1):
+        counters = self.store.counters
+        if inc == 1:
+            next_id = counters.take(counter_id)
+            if next_id is not None:
+                return next_id
+        increment = counters.increment(counter_id, inc)
+        return counters.add_block(counter_id, await self.redis.incr(counter_key(counter_id), increment), increment, inc)
+
+    async def delete_key(self, key):
+        await self.redis.delete(key)
+
+    async def set_index(self, index_name, key, value):
+        return await self.redis.hset(index_name, key, value)
+
+    async def get_index(self, index_name, key):
+        return await self.redis.hget(index_name, key)
+
+    async def delete_index(self, index_name, key):
+        return await self.redis.hdel(index_name, key)
+
+    async def set_db_hash(self, hash_id, hash_key, value):
+        return await self.redis.hset(hash_id, hash_key, json_encode(value))
+
+    async def get_db_hash(self, hash_id, hash_key):
+        return json_decode(await self.redis.hget(hash_id, hash_key))
+
+    async def get_all_db_hash(self, hash_id):
+        return [json_decode(value) for value in (await self.redis.hgetall(hash_id)).values()]
+
+    async def get_db_list(self, list_id, start=0, end=-1):
+        return [json_decode(value) for value in await self.redis.lrange(list_id, start, end)]
+
+    async def add_db_list(self, list_id, value, max_len=0):
+        if not max_len:
+            await self.redis.lpush(list_id, json_encode(value))
+            return
+        pipeline = self.redis.pipeline()
+        pipeline.lpush(list_id, json_encode(value))
+        pipeline.ltrim(list_id, 0, max_len - 1)
+        await pipeline.execute()
+
+    async def fetch_graph(self, dbo_keys):
+        prefetched = {}
+        walk = self.store.walk_graph(dbo_keys, prefetched)
+        try:
+            level = next(walk)
+            while True:
+                level = walk.send(await self.raw_redis.mget(level))
+        except StopIteration:
+            pass
+        return prefetched
+
+    async def _queue_save(self, dbo, pipeline, update_timestamp):
+        if update_timestamp:
+            dbo.dbo_ts = int(time.time())
+        # The index script may be missing after a server restart or SCRIPT FLUSH, as in RedisStore._read_pipeline
+        for attempt in range(2):
+            reads = self.redis.pipeline(transaction=False)
+            save_reads = self.store._queue_save_reads(dbo, reads)
+            try:
+                results = await reads.execute() if len(reads) else []
+                break
+            except NoScriptError:
+                if attempt:
+                    raise
+                self.store._ix_sha = await self.redis.script_load(IX_UPDATE_SCRIPT)
+        return self.store._queue_save_writes(dbo, save_reads, results, pipeline)
+
+    async def _execute_saves(self, pipeline, staged):
+        try:
+            await pipeline.execute()
+        except Exception:
+            await self._revert_indexes(self.store._abandon_saves(staged))
+            raise
+        self.store._apply_saves(staged)
+
+    async def _revert_indexes(self, ix_updates):
+        if not ix_updates:
+            return
+        pipeline = self.redis.pipeline(transaction=False)
+        self.store._queue_index_reverts(ix_updates, pipeline)
+        try:
+            await pipeline.execute()
+        except Exception:
+            log.exception("Failed to revert index updates {}", ix_updates)
+
+
+class ObjectSetIterator:
+    """
+    Asynchronous iterator for AsyncRedisStore.iter_object_set.  Members whose object is missing are removed from
+    the set, with one SREM per chunk.
+    """
+
+    def __init__(self, async_store, key_type, set_key, chunk_size):
+        self.async_store = async_store
+        self.key_type = key_type
+        self.set_key = set_key
+        self.chunk_size = chunk_size
+        self._cursor = 0
+        # SSCAN can return a member more than once
+        self._seen = set()
+        self._loaded = deque()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._loaded:
+            if self._cursor is None:
+                raise StopAsyncIteration
+            cursor, scan_ids = await self.async_store.redis.sscan(self.set_key, self._cursor, count=self.chunk_size)
+            self._cursor = int(cursor) or None
+            scan_ids = [dbo_id for dbo_id in scan_ids if dbo_id not in self._seen]
+            self._seen.update(scan_ids)
+            for start in range(0, len(scan_ids), self.chunk_size):
+                await self._load(scan_ids[start:start + self.chunk_size])
+        return self._loaded.popleft()
+
+    async def _load(self, dbo_ids):
+        dbo_keys = [':'.join((self.key_type, dbo_id)) for dbo_id in dbo_ids]
+        missing = []
+        for dbo_id, dbo in zip(dbo_ids, await self.async_store.load_objects(dbo_keys)):
+            if dbo:
+                self._loaded.append(dbo)
+            else:
+                missing.append(dbo_id)
+        if missing:
+            log.warn("Removing {} missing objects from set {}", len(missing), self.set_key)
+            await self.async_store.redis.srem(self.set_key, *missing)
+
+
+class AsyncPoolGauges(PoolGauges):
+    """
+    PoolGauges for redis.asyncio connection pools, where checkout and release are coroutines.  The pool methods
+    are called past the synchronous PoolGauges versions.
+    """
+
+    async def get_connection(self, *args, **kwargs):
+        start_time = time.time()
+        try:
+            connection = await super(PoolGauges, self).get_connection(*args, **kwargs)
+        except ConnectionError:
+            self.checkout_failures += 1
+            raise
+        self._checked_out(start_time)
+        return connection
+
+    async def release(self, connection):
+        self.in_use -= 1
+        await super(PoolGauges, self).release(connection)
+
+
+def _async_pool(aioredis, pool):
+    # Same connection limit and checkout timeout as the synchronous pool
+    pool_kwargs = dict(pool.connection_kwargs, max_connections=pool.max_connections)
+    if isinstance(pool, BlockingConnectionPool):
+        base_class, pool_kwargs['timeout'] = aioredis.BlockingConnectionPool, pool.timeout
+    else:
+        base_class = aioredis.ConnectionPool
+    pool_class = type('AsyncGauged{}'.format(base_class.__name__), (AsyncPoolGauges, base_class), {})
+    return pool_class(**pool_kwargs)
+
+
+class InlineAsyncStore:
+    """
+    Awaitable interface that runs the synchronous datastore call directly.  Used for the in process MemoryStore,
+    whose calls never wait on the network, and when no asyncio Redis client is available.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getattr__(self, name):
+        func = getattr(self.store, name)
+
+        async def call(*args, **kwargs):
+            return func(*args, **kwargs)
+
+        setattr(self, name, call)
+        return call
+
+    def iter_object_set(self, *args, **kwargs):
+        return InlineIterator(self.store.iter_object_set(*args, **kwargs))
+
+
+class InlineIterator:
+    def __init__(self, iterator):
+        self.iterator = iterator
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class DBOLoader:
+    """
+    DataLoader style coalescer.  Every load requested during the same event loop tick is fetched together
+    with one MGET per level of the object graph, then hydrated in a single synchronous pass.
+    """
+
+    def __init__(self, async_store):
+        self.async_store = async_store
+        self._pending = {}
+
+    def load(self, dbo_key):
+        try:
+            return self._pending[dbo_key]
+        except KeyError:
+            pass
+        loop = asyncio.get_event_loop()
+        if not self._pending:
+            loop.call_soon(self._dispatch)
+        future = loop.create_future()
+        self._pending[dbo_key] = future
+        return future
+
+    def _dispatch(self):
+        pending, self._pending = self._pending, {}
+        asyncio.ensure_future(self._fetch(pending))
+
+    async def _fetch(self, pending):
+        dbo_keys = list(pending.keys())
+        try:
+            prefetched = await self.async_store.fetch_graph(dbo_keys)
+            dbos = self.async_store.store.hydrate_prefetched(dbo_keys, prefetched, True)
+        except Exception as exp:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(exp)
+            return
+        for future, dbo in zip(pending.values(), dbos):
+            if not future.done():
+                future.set_result(dbo)
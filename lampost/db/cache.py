@@ -0,0 +1,113 @@
+import time
+
+from collections import OrderedDict, defaultdict
+from weakref import WeakKeyDictionary
+
+from lampost.di.app import on_app_start
+from lampost.di.config import on_config_change, config_value
+
+
+class DBOCache:
+    """
+    Strong reference LRU tier for database objects.  The datastore object map only holds weak references, so
+    without this tier an object is reloaded from the database as soon as the last game reference is released.
+
+    Limits are read from the configuration values dbo_cache_entries, dbo_cache_bytes (approximate, based
+    on the stored value size), dbo_cache_ttl (seconds since last access) and dbo_cache_type_limits (a map
+    of dbo_key_type to maximum entries).  A zero or missing entry limit disables the cache.
+    """
+
+    def __init__(self, max_entries=0, max_bytes=0, ttl=0, type_limits=None):
+        self._entries = OrderedDict()
+        self._type_entries = defaultdict(OrderedDict)
+        # Last stored size of each live object, used when an object that left the tier is read again
+        self._sizes = WeakKeyDictionary()
+        self.total_bytes = 0
+        self.reset_stats()
+        self.configure(max_entries, max_bytes, ttl, type_limits)
+        on_app_start(self._config)
+        on_config_change(self._config)
+
+    def configure(self, max_entries=0, max_bytes=0, ttl=0, type_limits=None):
+        self.max_entries = max_entries or 0
+        self.max_bytes = max_bytes or 0
+        self.ttl = ttl or 0
+        self.type_limits = type_limits or {}
+        self._trim()
+
+    def touch(self, dbo_key, dbo):
+        try:
+            entry = self._entries[dbo_key]
+        except KeyError:
+            # Only the weak object map still held the object, the read puts it back in the tier
+            self.put(dbo_key, dbo, self._sizes.get(dbo, 0))
+            return
+        self.hits += 1
+        entry[2] = time.time()
+        self._entries.move_to_end(dbo_key)
+        type_entries = self._type_entries.get(entry[3])
+        if type_entries is not None:
+            type_entries.move_to_end(dbo_key)
+
+    def miss(self):
+        self.misses += 1
+
+    def put(self, dbo_key, dbo, size=0):
+        if not self.max_entries:
+            return
+        self.remove(dbo_key)
+        key_type = dbo_key.partition(':')[0]
+        self._entries[dbo_key] = [dbo, size, time.time(), key_type]
+        self._sizes[dbo] = size
+        self.total_bytes += size
+        type_limit = self.type_limits.get(key_type)
+        if type_limit is not None:
+            type_entries = self._type_entries[key_type]
+            type_entries[dbo_key] = None
+            while len(type_entries) > type_limit:
+                self._evict(next(iter(type_entries)))
+        self._trim()
+
+    def remove(self, dbo_key):
+        entry = self._entries.pop(dbo_key, None)
+        if entry:
+            self.total_bytes -= entry[1]
+            type_entries = self._type_entries.get(entry[3])
+            if type_entries is not None:
+                type_entries.pop(dbo_key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._type_entries.clear()
+        self.total_bytes = 0
+
+    def reset_stats(self):
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def stats(self):
+        type_counts = defaultdict(int)
+        for entry in self._entries.values():
+            type_counts[entry[3]] += 1
+        return {'entries': len(self._entries), 'bytes': self.total_bytes, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'expirations': self.expirations, 'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes, 'ttl': self.ttl, 'types': dict(type_counts)}
+
+    def _evict(self, dbo_key):
+        self.remove(dbo_key)
+        self.evictions += 1
+
+    def _trim(self):
+        if self.ttl:
+            expire_time = time.time() - self.ttl
+            for dbo_key, entry in list(self._entries.items()):
+                if entry[2] > expire_time:
+                    break
+                self.remove(dbo_key)
+                self.expirations += 1
+        while self._entries and (len(self._entries) > self.max_entries or
+                                 (self.max_bytes and self.total_bytes > self.max_bytes)):
+            self._evict(next(iter(self._entries)))
+
+    def _config(self):
+        self.configure(config_value('dbo_cache_entries', 0), config_value('dbo_cache_bytes', 0),
+                       config_value('dbo_cache_ttl', 0), config_value('dbo_cache_type_limits', {}))
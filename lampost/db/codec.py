@@ -0,0 +1,206 @@
+import importlib
+import time
+import zlib
+
+from collections import defaultdict
+
+from lampost.di.app import on_app_start
+from lampost.di.config import on_config_change, config_value
+from lampost.di.resource import Injected, module_inject
+
+log = Injected('log')
+json_encode = Injected('json_encode')
+json_decode = Injected('json_decode')
+module_inject(__name__)
+
+
+class JsonCodec:
+    """
+    The original untagged storage format.  Stored JSON objects always start with '{', so any other leading byte
+    is available as a format tag.
+    """
+    name = 'json'
+    tag = None
+
+    def encode(self, value):
+        return json_encode(value).encode('utf-8')
+
+    def decode(self, data):
+        return json_decode(data.decode('utf-8'))
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+    tag = b'\x01'
+
+    def __init__(self):
+        self._msgpack = importlib.import_module('msgpack')
+
+    def encode(self, value):
+        return self.tag + self._msgpack.packb(value, use_bin_type=True)
+
+    def decode(self, data):
+        return self._msgpack.unpackb(memoryview(data)[1:], raw=False, strict_map_key=False)
+
+
+_codec_types = {'json': JsonCodec, 'msgpack': MsgpackCodec}
+
+# Compressed values wrap an encoded value (in any codec format)
+ZLIB_TAG = 2
+ZDICT_TAG = 3
+
+
+class DBOCodec:
+    """
+    Encodes stored database objects with the codec named by the configuration value db_codec (default json).
+    Values in any known format can always be read, so the codec can be changed without converting existing data.
+    Old format values are rewritten when the object is next changed, or on its next save of any kind if
+    db_codec_migrate is set.  Binary codecs are optional dependencies, if one is not installed json is used.
+
+    Encoded values of at least db_compress_min bytes (0 disables compression) are compressed with zlib at
+    db_compress_level, using the preset dictionary registered for the dbo_key_type if there is one.  Compressed
+    values are tagged with their format (and dictionary id), so compressed and uncompressed values can be mixed.
+    """
+
+    def __init__(self, dict_loader=None):
+        self._json = JsonCodec()
+        self._decoders = {}
+        self.current = self._json
+        self.migrate = False
+        self.legacy_loads = 0
+        self.compress_min = 0
+        self.compress_level = 6
+        self._dict_loader = dict_loader
+        self._zdicts = {}
+        self._type_zdicts = {}
+        self.reset_compress_stats()
+        on_app_start(self._config)
+        on_config_change(self._config)
+
+    def select(self, codec_name='json', migrate=False):
+        self.migrate = migrate
+        if codec_name == self.current.name:
+            return
+        try:
+            codec = _codec_types[codec_name]()
+        except KeyError:
+            log.error("Unknown db_codec {}, using json", codec_name)
+            codec = self._json
+        except ImportError:
+            log.warn("Library for db_codec {} is not installed, using json", codec_name)
+            codec = self._json
+        if codec.tag:
+            self._decoders[codec.tag[0]] = codec
+        self.current = codec
+
+    def encode(self, value):
+        return self.current.encode(value)
+
+    def decode(self, data):
+        return self._codec(data).decode(data)
+
+    def is_current(self, data):
+        return self._codec(data) is self.current
+
+    def pack(self, data, key_type=None):
+        """
+        Compresses an encoded value for storage if it is large enough and compression makes it smaller
+        """
+        if not self.compress_min or len(data) < self.compress_min:
+            return data
+        start_time = time.perf_counter()
+        try:
+            dict_id, zdict = self._type_zdicts[key_type]
+        except KeyError:
+            packed = bytes((ZLIB_TAG,)) + zlib.compress(data, self.compress_level)
+        else:
+            compressor = zlib.compressobj(self.compress_level, zdict=zdict)
+            packed = bytes((ZDICT_TAG,)) + dict_id.to_bytes(4, 'big') + compressor.compress(data) + compressor.flush()
+        stats = self._compress_stats[key_type]
+        stats[0] += 1
+        stats[1] += len(data)
+        stats[3] += time.perf_counter() - start_time
+        if len(packed) >= len(data):
+            stats[2] += len(data)
+            return data
+        stats[2] += len(packed)
+        return packed
+
+    def unpack(self, data, key_type=None):
+        """
+        Returns the encoded value from a stored value, decompressing it if necessary
+        """
+        tag = data[0]
+        if tag != ZLIB_TAG and tag != ZDICT_TAG:
+            return data
+        start_time = time.perf_counter()
+        if tag == ZLIB_TAG:
+            unpacked = zlib.decompress(memoryview(data)[1:])
+        else:
+            decompressor = zlib.decompressobj(zdict=self._zdict(int.from_bytes(data[1:5], 'big')))
+            unpacked = decompressor.decompress(memoryview(data)[5:]) + decompressor.flush()
+        stats = self._compress_stats[key_type]
+        stats[4] += 1
+        stats[5] += time.perf_counter() - start_time
+        return unpacked
+
+    def add_dictionary(self, key_type, zdict):
+        dict_id = zlib.adler32(zdict)
+        self._zdicts[dict_id] = zdict
+        self._type_zdicts[key_type] = dict_id, zdict
+        return dict_id
+
+    def compress_stats(self):
+        return {key_type: {'compressed': stats[0], 'raw_bytes': stats[1], 'bytes': stats[2],
+                           'ratio': stats[2] / stats[1] if stats[1] else 1, 'compress_ms': stats[3] * 1000,
+                           'decompressed': stats[4], 'decompress_ms': stats[5] * 1000,
+                           'dictionary': key_type in self._type_zdicts}
+                for key_type, stats in self._compress_stats.items()}
+
+    def reset_compress_stats(self):
+        self._compress_stats = defaultdict(lambda: [0, 0, 0, 0.0, 0, 0.0])
+
+    def _zdict(self, dict_id):
+        try:
+            return self._zdicts[dict_id]
+        except KeyError:
+            pass
+        # Dictionaries trained by another server process since this one started
+        zdict = self._dict_loader(dict_id) if self._dict_loader else None
+        if not zdict:
+            raise ValueError("Compression dictionary {} not found".format(dict_id))
+        self._zdicts[dict_id] = zdict
+        return zdict
+
+    def _codec(self, data):
+        tag = data[0]
+        if tag == 123:  # '{'
+            return self._json
+        try:
+            return self._decoders[tag]
+        except KeyError:
+            pass
+        # A value written by another server process using a codec this process has not selected
+        for codec_type in _codec_types.values():
+            if codec_type.tag and codec_type.tag[0] == tag:
+                codec = self._decoders[tag] = codec_type()
+                return codec
+        return self._json
+
+    def _config(self):
+        self.select(config_value('db_codec', 'json'), config_value('db_codec_migrate', False))
+        self.compress_min = config_value('db_compress_min', 0)
+        self.compress_level = config_value('db_compress_level', 6)
+
+
+def train_dictionary(samples, size=32768):
+    """
+    Builds a zlib preset dictionary from sample encoded values.  zlib only looks back 32KB, and content nearer the
+    end of the dictionary is cheaper to reference, so the first samples are placed at the end.
+    """
+    zdict = bytearray()
+    for sample in reversed(samples):
+        if len(zdict) >= size:
+            break
+        zdict[0:0] = sample[-(size - len(zdict)):]
+    return bytes(zdict)
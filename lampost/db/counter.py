@@ -0,0 +1,100 @@
+from lampost.di.app import on_app_start
+from lampost.di.config import on_config_change, config_value
+
+DEFAULT_BLOCKS = {'message_id': 100, 'channel': 20}
+
+
+class CounterBlocks:
+    """
+    Hi-lo allocator for database counters.  A counter with a block size reserves that many ids with a single
+    INCRBY and hands them out from memory until the block is used up, so ids stay unique across every process
+    sharing the database.  Ids are only increasing within a process, and the unused part of a block is skipped
+    when the process exits.
+
+    Block sizes are read from the configuration value db_counter_blocks (a map of counter_id to block size),
+    which overrides DEFAULT_BLOCKS.  Counters with no block size, or a size of 1, are incremented directly.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.block_sizes = DEFAULT_BLOCKS.copy()
+        self._blocks = {}
+        self.reset_stats()
+        on_app_start(self._config)
+        on_config_change(self._config)
+
+    def next_id(self, counter_id, inc=1):
+        if inc == 1:
+            next_id = self.take(counter_id)
+            if next_id is not None:
+                return next_id
+        increment = self.increment(counter_id, inc)
+        return self.add_block(counter_id, self.redis.incr(counter_key(counter_id), increment), increment, inc)
+
+    def take(self, counter_id):
+        """
+        Returns the next reserved id for the counter, or None if its block is used up
+        """
+        try:
+            next_id, last_id = self._blocks[counter_id]
+        except KeyError:
+            return None
+        if next_id == last_id:
+            del self._blocks[counter_id]
+        else:
+            self._blocks[counter_id] = next_id + 1, last_id
+        self.served += 1
+        return next_id
+
+    def increment(self, counter_id, inc=1):
+        return self.block_sizes.get(counter_id, 1) if inc == 1 else inc
+
+    def add_block(self, counter_id, last_id, block_size, inc=1):
+        """
+        Records the result of incrementing the counter in the database by block_size and returns the first id
+        of the new block
+        """
+        self.round_trips += 1
+        if inc != 1:
+            # The rest of the local block is below this id, drop it so ids keep increasing
+            self._blocks.pop(counter_id, None)
+            return last_id
+        if block_size <= 1:
+            return last_id
+        self.blocks += 1
+        self.served += 1
+        self._blocks[counter_id] = last_id - block_size + 2, last_id
+        return last_id - block_size + 1
+
+    def set_block_size(self, counter_id, block_size):
+        self.block_sizes[counter_id] = block_size
+        self.release(counter_id)
+
+    def release(self, counter_id=None):
+        """
+        Discards reserved ids so the next id comes from the database, for example after a counter is reset
+        """
+        if counter_id:
+            self._blocks.pop(counter_id, None)
+        else:
+            self._blocks.clear()
+
+    def reset_stats(self):
+        self.served = self.blocks = self.round_trips = 0
+
+    def stats(self):
+        return {'served': self.served, 'blocks': self.blocks, 'round_trips': self.round_trips,
+                'block_sizes': self.block_sizes,
+                'remaining': {counter_id: last_id - next_id + 1 for counter_id, (next_id, last_id)
+                              in self._blocks.items()}}
+
+    def _config(self):
+        block_sizes = DEFAULT_BLOCKS.copy()
+        block_sizes.update(config_value('db_counter_blocks', {}))
+        if block_sizes != self.block_sizes:
+            self.block_sizes = block_sizes
+            self._blocks.clear()
+
+
+def counter_key(counter_id):
+    return "counter:{}".format(counter_id)
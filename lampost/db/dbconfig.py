@@ -43,8 +43,9 @@ def create(config_id, raw_configs, set_defaults=False):
             section.settings = setting_map.values()
             db.save_object(section)
 
-    for rc in raw_configs:
-        add_raw(rc)
+    with db.batch():
+        for rc in raw_configs:
+            add_raw(rc)
 
     for setting_name, section_names in all_values.items():
         if len(section_names) > 1:
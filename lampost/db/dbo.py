@@ -3,7 +3,7 @@ from lampost.meta.core import CoreMeta
 from lampost.util.classes import call_mro, cls_name
 from lampost.db import dbofield
 from lampost.db.registry import set_dbo_class, get_dbo_class
-from lampost.db.dbofield import DBOField
+from lampost.db.dbofield import DBOField, hydrate_plan, save_plan
 
 log = Injected('log')
 perm = Injected('perm')
@@ -34,6 +34,9 @@ class DBOAspect(metaclass=CoreMeta):
                     if old_attr and old_attr.default != attr.default:
                         log.info("Overriding default value of attr {} in class {}", name, cls.__name__)
                     cls.dbo_fields[name] = attr
+        # Rebuilt whenever the field set changes, including fields added later by add_dbo_fields
+        cls._dbo_hydrate = hydrate_plan(cls.dbo_fields)
+        cls._dbo_save_value = save_plan(cls.dbo_fields)
 
     @classmethod
     def add_dbo_fields(cls, new_fields):
@@ -50,18 +53,7 @@ class CoreDBO(DBOAspect):
         call_mro(self, '_on_loaded')
 
     def hydrate(self, dto):
-        missing_fields = []
-        for field, dbo_field in self.dbo_fields.items():
-            if field in dto:
-                dbo_value = dbo_field.hydrate(self, dto[field])
-            else:
-                dbo_value = None
-                try:
-                    delattr(self, field)
-                except AttributeError:
-                    pass
-            if not dbo_value and dbo_field.required:
-                missing_fields.append(field)
+        missing_fields = self._dbo_hydrate(dto)
         self.on_loaded()
         if missing_fields:
             log.warn("Missing required fields {} in class {} dto {}", ', '.join(missing_fields),
@@ -85,12 +77,7 @@ class CoreDBO(DBOAspect):
 
     @property
     def save_value(self):
-        save_value = {}
-        for field, dbo_field in self.dbo_fields.items():
-            try:
-                save_value[field] = dbo_field.save_value(self)
-            except KeyError:
-                continue
+        save_value = self._dbo_save_value()
         if hasattr(self, 'template_key'):
             save_value['tk'] = self.template_key
         return save_value
@@ -227,7 +214,7 @@ class KeyDBO(CoreDBO):
         call_mro(self, '_on_db_deleted')
 
     def autosave(self):
-        db.save_object(self, autosave=True)
+        db.queue_save(self)
 
     def to_db_value(self):
         return self.save_value, dbofield.save_value_refs.current
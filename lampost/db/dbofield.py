@@ -12,6 +12,9 @@ module_inject(__name__)
 # collection recursively
 save_value_refs = local()
 
+# Returned by save steps for fields that hold their default (or template) value and are not saved
+NO_VALUE = object()
+
 
 class DBOField(AutoField):
     def __init__(self, default=None, dbo_class_id=None, required=False):
@@ -22,6 +25,7 @@ class DBOField(AutoField):
     def _meta_init(self, field):
         self.field = field
         self._hydrate_func = get_hydrate_func(load_any, self.default, self.dbo_class_id)
+        self.ref_keys = ref_keys_func(self.default, self.dbo_class_id)
         self.dto_value = value_transform(to_dto_repr, self.default, field, self.dbo_class_id, for_json=True)
         self.cmp_value = value_transform(to_save_repr, self.default, field, self.dbo_class_id)
         self._save_value = value_transform(to_save_repr, self.default, field, self.dbo_class_id, for_json=True)
@@ -37,12 +41,103 @@ class DBOField(AutoField):
         return value
 
     def check_default(self, value, instance):
-        if hasattr(self.default, 'save_value'):
-            if value == self.default.save_value:
-                raise KeyError
-        elif value == self.default:
+        if self._is_default(value, instance):
             raise KeyError
 
+    def hydrate_step(self):
+        """
+        Returns a function (instance, instance_dict, dto) that sets this field from the dto (or clears it if the
+        field is not in the dto) and returns the hydrated value.  Used to build the per class hydrate plan.
+        """
+        cls = type(self)
+        field, default = self.field, self.default
+        if cls.__delete__ is not AutoField.__delete__ or cls.hydrate not in (DBOField.hydrate, DBOLField.hydrate) \
+                or (cls.hydrate is DBOField.hydrate and cls.__set__ is not AutoField.__set__):
+            def hydrate_step(instance, inst_dict, dto):
+                if field in dto:
+                    return self.hydrate(instance, dto[field])
+                try:
+                    delattr(instance, field)
+                except AttributeError:
+                    pass
+            return hydrate_step
+
+        if cls.hydrate is DBOLField.hydrate:
+            def hydrate_step(instance, inst_dict, dto):
+                if field in dto:
+                    value = inst_dict[field] = dto[field]
+                    return value
+                inst_dict.pop(field, None)
+            return hydrate_step
+
+        if not self.dbo_class_id:
+            def hydrate_step(instance, inst_dict, dto):
+                if field not in dto:
+                    inst_dict.pop(field, None)
+                    return
+                value = dto[field]
+                if value == default:
+                    inst_dict.pop(field, None)
+                else:
+                    inst_dict[field] = value
+                return value
+            return hydrate_step
+
+        hydrate_func = self._hydrate_func
+
+        def hydrate_step(instance, inst_dict, dto):
+            if field not in dto:
+                inst_dict.pop(field, None)
+                return
+            value = hydrate_func(instance, dto[field])
+            if value == default:
+                inst_dict.pop(field, None)
+            else:
+                inst_dict[field] = value
+            return value
+        return hydrate_step
+
+    def save_step(self):
+        """
+        Returns a function (instance, instance_dict) that returns the save value of this field, or NO_VALUE if the
+        field holds its default value.  Used to build the per class save plan.
+        """
+        cls = type(self)
+        field, default = self.field, self.default
+        if cls.save_value is not DBOField.save_value or cls.check_default is not DBOField.check_default \
+                or cls.__get__ not in (AutoField.__get__, TemplateField.__get__, DBOLField.__get__):
+            def save_step(instance, inst_dict):
+                try:
+                    return self.save_value(instance)
+                except KeyError:
+                    return NO_VALUE
+            return save_step
+
+        # For the known descriptors a value missing from the instance dictionary is always the default (or
+        # template) value, so it is never saved
+        if not self.dbo_class_id and cls._is_default is DBOField._is_default and cls.__get__ is AutoField.__get__ \
+                and not hasattr(default, 'save_value'):
+            def save_step(instance, inst_dict):
+                value = inst_dict.get(field, NO_VALUE)
+                if value is NO_VALUE or value == default:
+                    return NO_VALUE
+                return value
+            return save_step
+
+        save_value, is_default = self._save_value, self._is_default
+
+        def save_step(instance, inst_dict):
+            if field not in inst_dict:
+                return NO_VALUE
+            value = save_value(instance)
+            return NO_VALUE if is_default(value, instance) else value
+        return save_step
+
+    def _is_default(self, value, instance):
+        if hasattr(self.default, 'save_value'):
+            return value == self.default.save_value
+        return value == self.default
+
 
 class DBOTField():
     """
@@ -80,19 +175,20 @@ class DBOCField(DBOField, TemplateField):
         self.kwargs = kwargs
         super().__init__(*args, **kwargs)
 
-    def check_default(self, value, instance):
+    def _is_default(self, value, instance):
         if self.field not in instance.__dict__:
-            raise KeyError
+            return True
         try:
             template_value = getattr(instance.template, self.field)
+        except AttributeError:
+            pass
+        else:
             if hasattr(template_value, 'cmp_value'):
                 if value == template_value.cmp_value:
-                    raise KeyError
+                    return True
             elif value == template_value:
-                raise KeyError
-        except AttributeError:
-            pass
-        super().check_default(value, instance)
+                return True
+        return super()._is_default(value, instance)
 
 
 class DBOLField(DBOField):
@@ -133,6 +229,10 @@ class DBOLField(DBOField):
     def _save_value(self, instance):
         return self._save_ref(instance, instance.__dict__.get(self.field, self.default))
 
+    def ref_keys(self, dto_repr):
+        # Lazy references are only loaded on access, so they are never prefetched
+        return ()
+
     def _meta_init(self, field):
         self.field = field
         self._hydrate_func = get_hydrate_func(load_keyed, self.default, self.dbo_class_id)
@@ -140,6 +240,40 @@ class DBOLField(DBOField):
         self._set_value = set_transform(to_dto_repr, self.default, self.dbo_class_id)
 
 
+def hydrate_plan(dbo_fields):
+    """
+    Builds the hydrate function for a class from its dbo_fields.  The function hydrates an instance from a dto and
+    returns the list of missing required fields.
+    """
+    steps = tuple((field, dbo_field.hydrate_step(), dbo_field.required) for field, dbo_field in dbo_fields.items())
+
+    def hydrate(instance, dto):
+        inst_dict = instance.__dict__
+        missing_fields = []
+        for field, hydrate_step, required in steps:
+            if not hydrate_step(instance, inst_dict, dto) and required:
+                missing_fields.append(field)
+        return missing_fields
+    return hydrate
+
+
+def save_plan(dbo_fields):
+    """
+    Builds the save value function for a class from its dbo_fields.  Fields holding their default value are omitted.
+    """
+    steps = tuple((field, dbo_field.save_step()) for field, dbo_field in dbo_fields.items())
+
+    def save_value(instance):
+        inst_dict = instance.__dict__
+        save_value = {}
+        for field, save_step in steps:
+            value = save_step(instance, inst_dict)
+            if value is not NO_VALUE:
+                save_value[field] = value
+        return save_value
+    return save_value
+
+
 def get_hydrate_func(load_func, default, class_id):
     if not class_id:
         return lambda instance, dto_repr: dto_repr
@@ -156,6 +290,17 @@ def get_hydrate_func(load_func, default, class_id):
     return lambda instance, dto_repr: load_func(class_id, instance, dto_repr)
 
 
+def ref_keys_func(default, class_id):
+    if not class_id:
+        return lambda dto_repr: ()
+    if isinstance(default, (list, set)):
+        return lambda dto_repr_list: (ref_key for dto_repr in dto_repr_list for ref_key in dto_ref_keys(class_id, dto_repr))
+    if isinstance(default, dict):
+        return lambda dto_repr_dict: (ref_key for dto_repr in dto_repr_dict.values() for ref_key in
+                                      dto_ref_keys(class_id, dto_repr))
+    return lambda dto_repr: dto_ref_keys(class_id, dto_repr)
+
+
 def value_transform(trans_func, default, field, class_id, for_json=False):
     if not class_id:
         return lambda instance: getattr(instance, field)
@@ -231,6 +376,42 @@ def save_keyed(class_id, dbo_owner, dto_repr):
     return dto_repr
 
 
+def dbo_ref_keys(dbo_class, dto):
+    for field, dbo_field in dbo_class.dbo_fields.items():
+        try:
+            dto_value = dto[field]
+        except KeyError:
+            continue
+        yield from dbo_field.ref_keys(dto_value)
+
+
+def dto_ref_keys(class_id, dto_repr):
+    # Follows the same resolution rules as load_any, but only yields the database keys that load_any would load
+    if not dto_repr:
+        return
+
+    dbo_ref_id = None
+    try:
+        class_id = dto_repr['class_id']
+    except TypeError:
+        dbo_ref_id = dto_repr
+    except KeyError:
+        pass
+
+    dbo_class = get_dbo_class(class_id)
+    if not dbo_class:
+        return
+
+    if hasattr(dbo_class, 'dbo_key_type'):
+        yield '{}:{}'.format(dbo_class.dbo_key_type, dbo_ref_id)
+    elif dbo_ref_id:
+        yield dbo_ref_id
+    elif dto_repr.get('tk'):
+        yield dto_repr['tk']
+    else:
+        yield from dbo_ref_keys(dbo_class, dto_repr)
+
+
 def load_any(class_id, dbo_owner, dto_repr):
     if not dto_repr:
         return
@@ -0,0 +1,389 @@
+import atexit
+import fnmatch
+import hashlib
+import os
+import pickle
+import random
+
+from itertools import islice
+
+from redis.exceptions import NoScriptError, ResponseError
+
+from lampost.di.app import on_app_start
+from lampost.di.resource import Injected, module_inject
+from lampost.db.redisstore import RedisStore, IX_UPDATE_SCRIPT
+
+log = Injected('log')
+ev = Injected('dispatcher')
+module_inject(__name__)
+
+
+class MemoryStore(RedisStore):
+    """
+    RedisStore backed by Python dictionaries in this process instead of a Redis server.  Intended for benchmarks,
+    tests and small single process installations.  If snapshot_file is set the data is loaded from it at startup,
+    written back every snapshot_interval seconds (if non zero) and on exit.
+    """
+
+    def __init__(self, snapshot_file=None, snapshot_interval=0):
+        self.snapshot_file = snapshot_file
+        self.snapshot_interval = snapshot_interval
+        self.data = MemoryData()
+        if snapshot_file and os.path.exists(snapshot_file):
+            with open(snapshot_file, 'rb') as snapshot:
+                self.data.values = pickle.load(snapshot)
+            log.info("Loaded {} keys from snapshot {}", len(self.data.values), snapshot_file)
+        self.pool = MemoryPool()
+        self.raw_pool = MemoryPool()
+        self.redis = MemoryRedis(self.data, True)
+        self.raw_redis = MemoryRedis(self.data, False)
+        self._init_store()
+        if snapshot_file:
+            on_app_start(self._start_snapshots)
+            atexit.register(self.snapshot)
+
+    def snapshot(self):
+        # Pending deferred saves are part of the data set
+        self.write_queue.drain()
+        temp_file = '{}.tmp'.format(self.snapshot_file)
+        with open(temp_file, 'wb') as snapshot:
+            pickle.dump(self.data.values, snapshot, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, self.snapshot_file)
+        log.debug("Wrote {} keys to snapshot {}", len(self.data.values), self.snapshot_file)
+
+    def _start_snapshots(self):
+        if self.snapshot_interval:
+            ev.register_p(self.snapshot, seconds=self.snapshot_interval)
+
+
+class MemoryPool:
+    def gauges(self):
+        return {}
+
+    def reset_gauges(self):
+        pass
+
+
+class MemoryData:
+    """
+    Shared key space.  As in Redis, strings, set members, hash fields and list items are stored as bytes, and
+    empty collections are removed.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.cursors = {}
+        self.next_cursor = 1
+
+
+_type_names = {bytes: 'string', set: 'set', dict: 'hash', list: 'list'}
+
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return str(value).encode('utf-8')
+
+
+def _key(key):
+    return key.decode('utf-8') if isinstance(key, bytes) else key
+
+
+class MemoryRedis:
+    """
+    Implements the subset of the redis client API used by RedisStore, with the same reply types.
+    """
+
+    def __init__(self, data, decode_responses):
+        self._data = data
+        self._values = data.values
+        self._decode = decode_responses
+        self._scripts = {hashlib.sha1(IX_UPDATE_SCRIPT.encode('utf-8')).hexdigest(): self._ix_update}
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    def ping(self):
+        return True
+
+    def flushdb(self):
+        self._values.clear()
+        return True
+
+    def script_load(self, script):
+        sha = hashlib.sha1(script.encode('utf-8')).hexdigest()
+        if sha not in self._scripts:
+            raise ResponseError("Scripts are not supported by the memory datastore")
+        return sha
+
+    def evalsha(self, sha, numkeys, *keys_and_args):
+        try:
+            script = self._scripts[sha]
+        except KeyError:
+            raise NoScriptError("No matching script")
+        return script(keys_and_args[:numkeys], [_encode(arg) for arg in keys_and_args[numkeys:]])
+
+    # Keys
+
+    def exists(self, *keys):
+        return sum(1 for key in keys if _key(key) in self._values)
+
+    def delete(self, *keys):
+        return sum(1 for key in keys if self._values.pop(_key(key), None) is not None)
+
+    def type(self, key):
+        value = self._values.get(_key(key))
+        type_name = 'none' if value is None else _type_names[type(value)]
+        return type_name if self._decode else type_name.encode('utf-8')
+
+    def keys(self, pattern='*'):
+        return [self._out_key(key) for key in self._values if fnmatch.fnmatchcase(key, pattern)]
+
+    def scan(self, cursor=0, match=None, count=None, **_):
+        return self._scan(cursor, match, count, lambda: list(self._values))
+
+    def scan_iter(self, match=None, count=None):
+        cursor = 0
+        while True:
+            cursor, keys = self.scan(cursor, match, count)
+            yield from keys
+            if not cursor:
+                return
+
+    # Strings
+
+    def get(self, key):
+        return self._out(self._string(key))
+
+    def mget(self, keys, *args):
+        keys = list(keys) + list(args) if isinstance(keys, (list, tuple, set)) else [keys] + list(args)
+        values = (self._values.get(_key(key)) for key in keys)
+        return [self._out(value) if isinstance(value, bytes) else None for value in values]
+
+    def set(self, key, value):
+        self._values[_key(key)] = _encode(value)
+        return True
+
+    def incr(self, key, amount=1):
+        value = int(self._string(key) or 0) + amount
+        self._values[_key(key)] = _encode(value)
+        return value
+
+    incrby = incr
+
+    # Sets
+
+    def sadd(self, key, *values):
+        members = self._collection(key, set, True)
+        size = len(members)
+        members.update(_encode(value) for value in values)
+        return len(members) - size
+
+    def srem(self, key, *values):
+        members = self._collection(key, set)
+        size = len(members)
+        members.difference_update(_encode(value) for value in values)
+        self._prune(key, members)
+        return size - len(members)
+
+    def smembers(self, key):
+        return {self._out(member) for member in self._collection(key, set)}
+
+    def sismember(self, key, value):
+        return _encode(value) in self._collection(key, set)
+
+    def scard(self, key):
+        return len(self._collection(key, set))
+
+    def srandmember(self, key, number=None):
+        members = list(self._collection(key, set))
+        if number is None:
+            return self._out(random.choice(members)) if members else None
+        return [self._out(member) for member in random.sample(members, min(number, len(members)))]
+
+    def sscan(self, name, cursor=0, match=None, count=None):
+        return self._scan(cursor, match, count, lambda: [self._out(member) for member in self._collection(name, set)])
+
+    # Hashes
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        fields = self._collection(name, dict, True)
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        added = 0
+        for field, field_value in items.items():
+            field = _encode(field)
+            added += field not in fields
+            fields[field] = _encode(field_value)
+        return added
+
+    def hget(self, name, key):
+        return self._out(self._collection(name, dict).get(_encode(key)))
+
+    def hdel(self, name, *keys):
+        fields = self._collection(name, dict)
+        removed = sum(1 for key in keys if fields.pop(_encode(key), None) is not None)
+        self._prune(name, fields)
+        return removed
+
+    def hgetall(self, name):
+        return {self._out(field): self._out(value) for field, value in self._collection(name, dict).items()}
+
+    def hkeys(self, name):
+        return [self._out(field) for field in self._collection(name, dict)]
+
+    def hlen(self, name):
+        return len(self._collection(name, dict))
+
+    def hscan(self, name, cursor=0, match=None, count=None):
+        cursor, fields = self._scan(cursor, match, count, lambda: [self._out(field) for field in
+                                                                   self._collection(name, dict)])
+        current = self._collection(name, dict)
+        return cursor, {field: self._out(current[_encode(field)]) for field in fields if _encode(field) in current}
+
+    # Lists
+
+    def lpush(self, name, *values):
+        items = self._collection(name, list, True)
+        for value in values:
+            items.insert(0, _encode(value))
+        return len(items)
+
+    def rpush(self, name, *values):
+        items = self._collection(name, list, True)
+        items.extend(_encode(value) for value in values)
+        return len(items)
+
+    def lrange(self, name, start, end):
+        items = self._collection(name, list)
+        return [self._out(item) for item in items[_list_slice(len(items), start, end)]]
+
+    def ltrim(self, name, start, end):
+        items = self._collection(name, list)
+        items[:] = items[_list_slice(len(items), start, end)]
+        self._prune(name, items)
+        return True
+
+    def llen(self, name):
+        return len(self._collection(name, list))
+
+    def _out(self, value):
+        if value is not None and self._decode:
+            return value.decode('utf-8')
+        return value
+
+    def _out_key(self, key):
+        return key if self._decode else key.encode('utf-8')
+
+    def _string(self, key):
+        value = self._values.get(_key(key))
+        if value is not None and not isinstance(value, bytes):
+            raise ResponseError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _collection(self, key, coll_type, create=False):
+        key = _key(key)
+        try:
+            coll = self._values[key]
+        except KeyError:
+            coll = coll_type()
+            if create:
+                self._values[key] = coll
+            return coll
+        if type(coll) is not coll_type:
+            raise ResponseError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return coll
+
+    def _prune(self, key, coll):
+        if not coll:
+            self._values.pop(_key(key), None)
+
+    def _scan(self, cursor, match, count, snapshot):
+        # A cursor is a snapshot of the matching elements taken by the first call, so nothing present for the
+        # whole scan is missed.  Abandoned cursors are discarded once too many are open.
+        cursors = self._data.cursors
+        if not int(cursor):
+            elements = snapshot()
+            if match:
+                elements = [element for element in elements if fnmatch.fnmatchcase(_key(element), match)]
+            cursor = self._data.next_cursor
+            self._data.next_cursor += 1
+            cursors[cursor] = iter(elements)
+            while len(cursors) > 100:
+                del cursors[next(iter(cursors))]
+        cursor = int(cursor)
+        try:
+            elements = cursors[cursor]
+        except KeyError:
+            return 0, []
+        chunk = list(islice(elements, count or 10))
+        if len(chunk) < (count or 10):
+            del cursors[cursor]
+            cursor = 0
+        return cursor, chunk
+
+    def _ix_update(self, keys, args):
+        # Python version of IX_UPDATE_SCRIPT
+        dbo_id = args[0]
+        for ix, ix_key in enumerate(keys):
+            new_val = args[ix * 2 + 2]
+            if new_val:
+                owner = self._collection(ix_key, dict).get(new_val)
+                if owner is not None and owner != dbo_id:
+                    return ix + 1
+        for ix, ix_key in enumerate(keys):
+            old_val, new_val = args[ix * 2 + 1], args[ix * 2 + 2]
+            index = self._collection(ix_key, dict, True)
+            if old_val and index.get(old_val) == dbo_id:
+                del index[old_val]
+            if new_val:
+                index[new_val] = dbo_id
+            self._prune(ix_key, index)
+        return 0
+
+
+class MemoryPipeline:
+    """
+    Queues commands until execute.  The datastore is single threaded, so every pipeline is atomic.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.command_stack = []
+
+    def __len__(self):
+        return len(self.command_stack)
+
+    def __getattr__(self, name):
+        command = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self.command_stack.append((command, args, kwargs))
+            return self
+        return queue
+
+    def execute(self, raise_on_error=True):
+        results = []
+        for command, args, kwargs in self.command_stack:
+            try:
+                results.append(command(*args, **kwargs))
+            except ResponseError as exp:
+                results.append(exp)
+        self.command_stack = []
+        if raise_on_error:
+            for result in results:
+                if isinstance(result, ResponseError):
+                    raise result
+        return results
+
+    def reset(self):
+        self.command_stack = []
+
+
+def _list_slice(length, start, end):
+    if end < 0:
+        end += length
+    return slice(start if start >= 0 else max(length + start, 0), end + 1)
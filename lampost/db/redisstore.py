@@ -1,13 +1,22 @@
+import hashlib
 import time
 
-from collections import deque
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
 from weakref import WeakValueDictionary
 
-from redis import ConnectionPool
+from redis import ConnectionPool, BlockingConnectionPool
 from redis.client import StrictRedis
+from redis.exceptions import ConnectionError, NoScriptError
 
 from lampost.di.resource import Injected, module_inject
 from lampost.db.registry import get_dbo_class, get_mixed_type
+from lampost.db.dbofield import dbo_ref_keys
+from lampost.db.cache import DBOCache
+from lampost.db.codec import DBOCodec
+from lampost.db.counter import CounterBlocks
+from lampost.db.writebehind import WriteBehindQueue
 from lampost.db.exceptions import ObjectExistsError, NonUniqueError
 
 log = Injected('log')
@@ -15,14 +24,120 @@ json_encode = Injected('json_encode')
 json_decode = Injected('json_decode')
 module_inject(__name__)
 
+# KEYS are the index hashes to update, ARGV is the dbo_id followed by an (old value, new value) pair per index.
+# Returns 0 on success or the 1 based position of the first index whose new value belongs to another object,
+# in which case no index is changed.
+IX_UPDATE_SCRIPT = """
+for ix, ix_key in ipairs(KEYS) do
+    local new_val = ARGV[ix * 2 + 1]
+    if new_val ~= '' then
+        local owner = redis.call('HGET', ix_key, new_val)
+        if owner and owner ~= ARGV[1] then
+            return ix
+        end
+    end
+end
+for ix, ix_key in ipairs(KEYS) do
+    local old_val = ARGV[ix * 2]
+    local new_val = ARGV[ix * 2 + 1]
+    if old_val ~= '' and redis.call('HGET', ix_key, old_val) == ARGV[1] then
+        redis.call('HDEL', ix_key, old_val)
+    end
+    if new_val ~= '' then
+        redis.call('HSET', ix_key, new_val, ARGV[1])
+    end
+end
+return 0
+"""
+
+
+class PoolGauges:
+    """
+    Mixin for redis connection pools that records checkout gauges, used to size the pool from real data
+    """
+    in_use = 0
+    max_in_use = 0
+    checkouts = 0
+    checkout_failures = 0
+    total_wait = 0
+    max_wait = 0
+
+    def get_connection(self, *args, **kwargs):
+        start_time = time.time()
+        try:
+            connection = super().get_connection(*args, **kwargs)
+        except ConnectionError:
+            self.checkout_failures += 1
+            raise
+        self._checked_out(start_time)
+        return connection
+
+    def release(self, connection):
+        self.in_use -= 1
+        super().release(connection)
+
+    def _checked_out(self, start_time):
+        wait = time.time() - start_time
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.in_use += 1
+        self.max_in_use = max(self.max_in_use, self.in_use)
+
+    def gauges(self):
+        return {'max_connections': self.max_connections, 'in_use': self.in_use, 'max_in_use': self.max_in_use,
+                'checkouts': self.checkouts, 'checkout_failures': self.checkout_failures,
+                'avg_wait': self.total_wait / self.checkouts if self.checkouts else 0, 'max_wait': self.max_wait}
+
+    def reset_gauges(self):
+        self.max_in_use = self.in_use
+        self.checkouts = self.checkout_failures = 0
+        self.total_wait = self.max_wait = 0
+
+
+class GaugedConnectionPool(PoolGauges, ConnectionPool):
+    pass
+
+
+class GaugedBlockingConnectionPool(PoolGauges, BlockingConnectionPool):
+    pass
+
 
 class RedisStore:
-    def __init__(self, db_host, db_port, db_num, db_pw):
-        self.pool = ConnectionPool(max_connections=2, db=db_num, host=db_host, port=db_port, password=db_pw,
-                                   decode_responses=True)
+    def __init__(self, db_host, db_port, db_num, db_pw, pool_size=2, pool_timeout=None, keepalive=False):
+        # pool_size is the total for both pools, stored values (read as bytes) get half of the connections
+        raw_size = max(pool_size // 2, 1)
+        pool_kwargs = {'max_connections': max(pool_size - raw_size, 1), 'db': db_num, 'host': db_host,
+                       'port': db_port, 'password': db_pw, 'decode_responses': True, 'socket_keepalive': keepalive}
+        if pool_timeout is None:
+            pool_class = GaugedConnectionPool
+        else:
+            # Callers wait up to pool_timeout seconds for a free connection instead of failing immediately
+            pool_class, pool_kwargs['timeout'] = GaugedBlockingConnectionPool, pool_timeout
+        self.pool = pool_class(**pool_kwargs)
         self.redis = StrictRedis(connection_pool=self.pool)
         self.redis.ping()
+        # Stored values are read as bytes, they may be in a binary format
+        pool_kwargs['decode_responses'] = False
+        pool_kwargs['max_connections'] = raw_size
+        self.raw_pool = pool_class(**pool_kwargs)
+        self.raw_redis = StrictRedis(connection_pool=self.raw_pool)
+        self._init_store()
+
+    def _init_store(self):
         self._object_map = WeakValueDictionary()
+        self.dbo_cache = DBOCache()
+        self.codec = DBOCodec(self._load_zdict)
+        self.write_queue = WriteBehindQueue(self)
+        self.counters = CounterBlocks(self.redis)
+        self._batch_pipeline = None
+        self._batch_saves = None
+        self._batch_created = None
+        self._prefetched = None
+        self._async_store = None
+        self.reset_save_stats()
+        self._load_scripts()
+        self._load_zdicts()
 
     def create_object(self, dbo_class, dbo_dict, update_timestamp=True):
         dbo_class = get_dbo_class(getattr(dbo_class, 'dbo_key_type', dbo_class))
@@ -41,151 +156,305 @@ class RedisStore:
         dbo = dbo_class()
         dbo.dbo_id = dbo_id
         dbo.hydrate(dbo_dict)
+        dbo._dbo_ix = {}
+        dbo._dbo_refs = frozenset()
         dbo.db_created()
+        if self._batch_pipeline is not None:
+            if dbo.dbo_set_key:
+                self._batch_pipeline.sadd(dbo.dbo_set_key, dbo.dbo_id)
+            self._batch_created.add(dbo.dbo_key)
+            return self.save_object(dbo, update_timestamp)
+        pipeline = self.redis.pipeline()
         if dbo.dbo_set_key:
-            self.redis.sadd(dbo.dbo_set_key, dbo.dbo_id)
-        self.save_object(dbo, update_timestamp)
+            pipeline.sadd(dbo.dbo_set_key, dbo.dbo_id)
+        self._execute_saves(pipeline, [self._queue_save(dbo, pipeline, update_timestamp)])
         return dbo
 
+    @property
+    def async_store(self):
+        """
+        Awaitable interface to this store for coroutine link routes, created on first use
+        """
+        if self._async_store is None:
+            from lampost.db.asyncstore import async_datastore
+            self._async_store = async_datastore(self)
+        return self._async_store
+
     def load_object(self, dbo_key, key_type=None, silent=False):
-        if key_type:
-            try:
-                key_type = key_type.dbo_key_type
-            except AttributeError:
-                pass
-            try:
-                dbo_key, dbo_id = ':'.join((key_type, dbo_key)), dbo_key
-            except TypeError:
-                if not silent:
-                    log.exception("Invalid dbo_key passed to load_object", stack_info=True)
-                return
-        else:
-            key_type, _, dbo_id = dbo_key.partition(':')
+        try:
+            dbo_key, key_type, dbo_id = split_key(dbo_key, key_type)
+        except TypeError:
+            if not silent:
+                log.exception("Invalid dbo_key passed to load_object", stack_info=True)
+            return
         cached_dbo = self._object_map.get(dbo_key)
         if cached_dbo:
+            self.dbo_cache.touch(dbo_key, cached_dbo)
             return cached_dbo
-        json_str = self.redis.get(dbo_key)
-        if not json_str:
-            if not silent:
-                log.warn("Failed to find {} in database", dbo_key)
-            return
-        return self._json_to_obj(json_str, key_type, dbo_id)
-
-    def save_object(self, dbo, update_timestamp=False, autosave=False):
-        if update_timestamp:
-            dbo.dbo_ts = int(time.time())
-        if dbo.dbo_indexes:
-            self._update_indexes(dbo)
-        self._clear_old_refs(dbo)
-        save_root, new_refs = dbo.to_db_value()
-        self.redis.set(dbo.dbo_key, json_encode(save_root))
-        if new_refs:
-            self._set_new_refs(dbo, new_refs)
+        self.dbo_cache.miss()
+        if self._prefetched is not None:
+            return self._load_prefetched(dbo_key, key_type, dbo_id, silent)
+        self._prefetched = {}
+        try:
+            return self._load_prefetched(dbo_key, key_type, dbo_id, silent)
+        finally:
+            self._prefetched = None
+
+    def load_objects(self, dbo_keys, silent=False):
+        """
+        Loads a collection of full dbo keys, returning a list of objects (or None for missing keys) in the same order.
+        The keys and every reference reachable from them are fetched with one MGET per level of the object graph.
+        """
+        outer = self._prefetched is None
+        if outer:
+            self._prefetched = {}
+        try:
+            self._prefetch(dbo_keys)
+            return [self.load_object(dbo_key, silent=silent) for dbo_key in dbo_keys]
+        finally:
+            if outer:
+                self._prefetched = None
+
+    def hydrate_prefetched(self, dbo_keys, prefetched, silent=False):
+        """
+        Builds objects from a dictionary of decoded values already fetched by walk_graph, used by callers that
+        do their own (for example asynchronous) I/O.  Any reference missing from prefetched is loaded normally.
+        """
+        self._prefetched = prefetched
+        try:
+            return [self.load_object(dbo_key, silent=silent) for dbo_key in dbo_keys]
+        finally:
+            self._prefetched = None
+
+    def walk_graph(self, dbo_keys, prefetched):
+        """
+        Generator for a breadth first walk of the stored object graph.  Each yield is a list of keys to fetch,
+        the caller must send back the list of raw stored values.  Decoded values are collected in prefetched.
+        """
+        level = self._unresolved(dbo_keys, prefetched)
+        while level:
+            level = list(level)
+            raw_values = yield level
+            next_level = set()
+            for dbo_key, raw_value in zip(level, raw_values):
+                if not raw_value:
+                    prefetched[dbo_key] = None
+                    continue
+                key_type = dbo_key.partition(':')[0]
+                encoded = self.codec.unpack(raw_value, key_type)
+                dbo_dict = self.codec.decode(encoded)
+                prefetched[dbo_key] = dbo_dict, len(raw_value), self._load_digest(encoded, dbo_dict)
+                dbo_class = get_mixed_type(key_type, dbo_dict.get('mixins'))
+                if dbo_class:
+                    next_level.update(dbo_ref_keys(dbo_class, dbo_dict))
+            level = self._unresolved(next_level, prefetched)
+
+    def save_object(self, dbo, update_timestamp=False, autosave=False, force=False):
+        self.write_queue.discard(dbo.dbo_key)
+        if force:
+            dbo.__dict__.pop('_dbo_digest', None)
+        if self._batch_pipeline is not None:
+            # Saves are coalesced and written when the batch is flushed, the object map provides read-your-writes
+            if update_timestamp:
+                dbo.dbo_ts = int(time.time())
+            self._batch_saves[dbo.dbo_key] = dbo
+            self._object_map[dbo.dbo_key] = dbo
+            return dbo
+        pipeline = self.redis.pipeline()
+        self._execute_saves(pipeline, [self._queue_save(dbo, pipeline, update_timestamp)])
         log.debug("db object {} {}saved", dbo.dbo_key, "auto" if autosave else "")
-        self._object_map[dbo.dbo_key] = dbo
         return dbo
 
+    def queue_save(self, dbo):
+        """
+        Deferred save through the write behind queue, repeated calls before the next flush are coalesced
+        """
+        self.write_queue.queue_save(dbo)
+
+    def save_now(self, dbo):
+        """
+        Synchronously persists an object, including any write for it still pending in the write behind queue
+        """
+        return self.save_object(dbo, autosave=bool(self.write_queue.pop(dbo.dbo_key)))
+
     def update_object(self, dbo, dbo_dict):
         dbo.hydrate(dbo_dict)
         return self.save_object(dbo, True)
 
     def delete_object(self, dbo):
-        key = dbo.dbo_key
-        dbo.db_deleted()
-        self.delete_key(key)
-        self._clear_old_refs(dbo)
-        if dbo.dbo_set_key:
-            self.redis.srem(dbo.dbo_set_key, dbo.dbo_id)
-        for children_type in dbo.dbo_children_types:
-            self.delete_object_set(get_dbo_class(children_type),
-                                   "{}_{}s:{}".format(dbo.dbo_key_type, children_type, dbo.dbo_id))
-        for ix_name in dbo.dbo_indexes:
-            ix_value = getattr(dbo, ix_name, None)
-            if ix_value is not None and ix_value != '':
-                self.delete_index('ix:{}:{}'.format(dbo.dbo_key_type, ix_name), ix_value)
-        log.debug("object deleted: {}", key)
-        self.evict_object(dbo)
+        self.write_queue.discard(dbo.dbo_key)
+        if self._batch_pipeline is not None:
+            self._queue_delete(dbo, self._batch_pipeline)
+            return
+        pipeline = self.redis.pipeline()
+        self._queue_delete(dbo, pipeline)
+        pipeline.execute()
+
+    @contextmanager
+    def batch(self):
+        """
+        Unit of work context.  All writes made inside the context are queued into one shared MULTI/EXEC pipeline
+        that is executed when the outermost context exits.  Repeated saves of the same object are coalesced and
+        are written after any other batched writes.  Only load_object (through the object cache) is guaranteed
+        to see unflushed writes.  If the context exits with an exception, nothing is written, objects created in
+        the batch are evicted and objects saved in the batch are written in full on their next save.
+        """
+        if self._batch_pipeline is not None:
+            yield self
+            return
+        self._batch_pipeline = self.redis.pipeline()
+        self._batch_saves = OrderedDict()
+        self._batch_created = set()
+        try:
+            yield self
+            self._flush_batch()
+        except BaseException:
+            self._abort_batch()
+            raise
+        finally:
+            self._batch_pipeline.reset()
+            self._batch_pipeline = None
+            self._batch_saves = None
+            self._batch_created = None
 
     def load_cached(self, dbo_key):
         return self._object_map.get(dbo_key)
 
     def object_exists(self, obj_type, obj_id):
+        if self._batch_saves and '{}:{}'.format(obj_type, obj_id) in self._batch_saves:
+            return True
         return self.redis.exists('{}:{}'.format(obj_type, obj_id))
 
     def load_object_set(self, dbo_class, set_key=None):
+        return set(self.iter_object_set(dbo_class, set_key))
+
+    def iter_object_set(self, dbo_class, set_key=None, chunk_size=500):
+        """
+        Lazily yields the objects in a set.  Members are read with SSCAN and loaded chunk_size at a time, so
+        neither the set nor the objects are held in memory all at once.  Members whose object is missing are
+        removed from the set.
+        """
         dbo_class = get_dbo_class(getattr(dbo_class, 'dbo_key_type', dbo_class))
         key_type = dbo_class.dbo_key_type
         if not set_key:
             set_key = dbo_class.dbo_set_key
-        results = set()
-        keys = deque()
-        pipeline = self.redis.pipeline()
-        for key in self.fetch_set_keys(set_key):
-            dbo_key = ':'.join([key_type, key])
-            try:
-                results.add(self._object_map[dbo_key])
-            except KeyError:
-                keys.append(key)
-                pipeline.get(dbo_key)
-        for dbo_id, json_str in zip(keys, pipeline.execute()):
-            if json_str:
-                obj = self._json_to_obj(json_str, key_type, dbo_id)
-                if obj:
-                    results.add(obj)
-                continue
-            log.warn("Removing missing object from set {}", set_key)
-            self.delete_set_key(set_key, dbo_id)
-        return results
+        # SSCAN can return a member more than once
+        seen = set()
+        for scan_ids in self.scan_set(set_key, count=chunk_size):
+            scan_ids = [dbo_id for dbo_id in scan_ids if dbo_id not in seen]
+            seen.update(scan_ids)
+            for start in range(0, len(scan_ids), chunk_size):
+                dbo_ids = scan_ids[start:start + chunk_size]
+                dbo_keys = [':'.join((key_type, dbo_id)) for dbo_id in dbo_ids]
+                for dbo_id, dbo in zip(dbo_ids, self.load_objects(dbo_keys, True)):
+                    if dbo:
+                        yield dbo
+                        continue
+                    log.warn("Removing missing object from set {}", set_key)
+                    self.delete_set_key(set_key, dbo_id)
 
     def delete_object_set(self, dbo_class, set_key=None):
         if not set_key:
             set_key = dbo_class.dbo_set_key
-        for dbo in self.load_object_set(dbo_class, set_key):
+        for dbo in self.iter_object_set(dbo_class, set_key):
             self.delete_object(dbo)
         self.delete_key(set_key)
 
     def reload_object(self, dbo_key):
         dbo = self._object_map.get(dbo_key)
         if dbo:
-            json_str = self.redis.get(dbo_key)
-            if not json_str:
+            raw_value = self.raw_redis.get(dbo_key)
+            if not raw_value:
                 log.warn("Failed to find {} in database for reload", dbo_key)
                 return None
-            return self.update_object(dbo, json_decode(json_str))
+            return self.update_object(dbo, self._decode_value(dbo_key, raw_value))
         return self.load_object(dbo_key)
 
+    def forget_refs(self):
+        """
+        Drops the in memory record of persisted references (and the last saved value digest) for every cached
+        object, so their next save rewrites the full reference graph.  Required after the :refs and :holders
+        keys are rebuilt outside of save_object.
+        """
+        for dbo in list(self._object_map.values()):
+            dbo.__dict__.pop('_dbo_refs', None)
+            dbo.__dict__.pop('_dbo_digest', None)
+
+    def save_stats(self):
+        return {'writes': self.writes, 'skipped': self.writes_skipped, 'bytes': self.bytes_written,
+                'bytes_skipped': self.bytes_skipped, 'codec': self.codec.current.name,
+                'legacy_loads': self.codec.legacy_loads}
+
+    def reset_save_stats(self):
+        self.writes = self.writes_skipped = self.bytes_written = self.bytes_skipped = 0
+        self.codec.legacy_loads = 0
+
+    def set_compression_dict(self, key_type, zdict):
+        """
+        Registers a preset compression dictionary for values of key_type.  Dictionaries are kept in the database
+        by id, so values compressed with a replaced dictionary can still be read.
+        """
+        dict_id = self.codec.add_dictionary(key_type, zdict)
+        self.raw_redis.hset('codec:zdicts', dict_id, zdict)
+        self.redis.hset('codec:zdict_types', key_type, dict_id)
+        return dict_id
+
     def evict_object(self, dbo):
         self._object_map.pop(dbo.dbo_key, None)
+        self.dbo_cache.remove(dbo.dbo_key)
 
     def load_value(self, key, default=None):
-        json = self.redis.get(key)
-        if json:
-            return json_decode(json)
+        raw_value = self.raw_redis.get(key)
+        if raw_value:
+            return self._decode_value(key, raw_value)
         return default
 
     def save_value(self, key, value):
-        self.redis.set(key, json_encode(value))
+        self._writer.set(key, json_encode(value))
+
+    def load_values(self, keys):
+        if not keys:
+            return []
+        return [self._decode_value(key, raw_value) if raw_value else None for key, raw_value in
+                zip(keys, self.raw_redis.mget(keys))]
+
+    def scan_keys(self, pattern='*', count=1000):
+        """
+        Incrementally iterates the keyspace with SCAN, yielding the list of matching keys returned by each call.
+        Unlike KEYS this never blocks the server for more than about count keys.  A key may be returned more
+        than once, and keys added or removed during the scan may or may not be returned.
+        """
+        return self._scan(self.redis.scan, match=pattern, count=count)
+
+    def scan_set(self, set_key, pattern=None, count=1000):
+        return self._scan(partial(self.redis.sscan, set_key), match=pattern, count=count)
+
+    def scan_hash(self, hash_id, pattern=None, count=1000):
+        """
+        Incrementally iterates a hash with HSCAN, yielding a dictionary of the fields returned by each call
+        """
+        return self._scan(partial(self.redis.hscan, hash_id), match=pattern, count=count)
 
     def fetch_set_keys(self, set_key):
         return self.redis.smembers(set_key)
 
     def add_set_key(self, set_key, *values):
-        self.redis.sadd(set_key, *values)
+        self._writer.sadd(set_key, *values)
 
     def delete_set_key(self, set_key, value):
-        self.redis.srem(set_key, value)
+        self._writer.srem(set_key, value)
 
     def set_key_exists(self, set_key, value):
         return self.redis.sismember(set_key, value)
 
     def db_counter(self, counter_id, inc=1):
-        return self.redis.incr("counter:{}".format(counter_id), inc)
+        return self.counters.next_id(counter_id, inc)
 
     def delete_key(self, key):
-        self.redis.delete(key)
+        self._writer.delete(key)
 
     def set_index(self, index_name, key, value):
-        return self.redis.hset(index_name, key, value)
+        return self._writer.hset(index_name, key, value)
 
     def get_index(self, index_name, key):
         return self.redis.hget(index_name, key)
@@ -194,7 +463,7 @@ class RedisStore:
         return self.redis.hgetall(index_name)
 
     def delete_index(self, index_name, key):
-        return self.redis.hdel(index_name, key)
+        return self._writer.hdel(index_name, key)
 
     def get_all_hash(self, index_name):
         return {key: json_decode(value) for key, value in self.redis.hgetall(index_name).items()}
@@ -203,13 +472,13 @@ class RedisStore:
         return self.redis.hkeys(hash_id)
 
     def set_db_hash(self, hash_id, hash_key, value):
-        return self.redis.hset(hash_id, hash_key, json_encode(value))
+        return self._writer.hset(hash_id, hash_key, json_encode(value))
 
     def get_db_hash(self, hash_id, hash_key):
         return json_decode(self.redis.hget(hash_id, hash_key))
 
     def remove_db_hash(self, hash_id, hash_key):
-        self.redis.hdel(hash_id, hash_key)
+        self._writer.hdel(hash_id, hash_key)
 
     def get_all_db_hash(self, hash_id):
         return [json_decode(value) for value in self.redis.hgetall(hash_id).values()]
@@ -217,11 +486,22 @@ class RedisStore:
     def get_db_list(self, list_id, start=0, end=-1):
         return [json_decode(value) for value in self.redis.lrange(list_id, start, end)]
 
-    def add_db_list(self, list_id, value):
-        self.redis.lpush(list_id, json_encode(value))
+    def add_db_list(self, list_id, value, max_len=0):
+        """
+        Pushes a value to the head of a list.  If max_len is set the list is trimmed to that length in the same
+        transaction, so it never holds more than max_len values.
+        """
+        if not max_len:
+            self._writer.lpush(list_id, json_encode(value))
+            return
+        pipeline = self.redis.pipeline() if self._batch_pipeline is None else self._batch_pipeline
+        pipeline.lpush(list_id, json_encode(value))
+        pipeline.ltrim(list_id, 0, max_len - 1)
+        if self._batch_pipeline is None:
+            pipeline.execute()
 
     def trim_db_list(self, list_id, start, end):
-        return self.redis.ltrim(list_id, start, end)
+        return self._writer.ltrim(list_id, start, end)
 
     def dbo_holders(self, dbo_key, degrees=0):
         all_keys = set()
@@ -237,44 +517,295 @@ class RedisStore:
         find(dbo_key, 0)
         return all_keys
 
-    def _json_to_obj(self, json_str, key_type, dbo_id):
-        dbo_dict = json_decode(json_str)
+    def _scan(self, scan_func, **kwargs):
+        cursor = 0
+        while True:
+            cursor, chunk = scan_func(cursor=cursor, **kwargs)
+            if chunk:
+                yield chunk
+            if not int(cursor):
+                return
+
+    def _load_prefetched(self, dbo_key, key_type, dbo_id, silent):
+        if dbo_key not in self._prefetched:
+            self._prefetch((dbo_key,))
+        dbo_dict, size, digest = self._prefetched.pop(dbo_key, None) or (None, 0, None)
+        if dbo_dict is None:
+            if not silent:
+                log.warn("Failed to find {} in database", dbo_key)
+            return
+        dbo = self._dict_to_obj(dbo_dict, key_type, dbo_id)
+        dbo._dbo_digest = digest
+        self.dbo_cache.put(dbo.dbo_key, dbo, size)
+        return dbo
+
+    def _prefetch(self, dbo_keys):
+        # Hydration then finds every reachable reference already decoded
+        walk = self.walk_graph(dbo_keys, self._prefetched)
+        try:
+            level = next(walk)
+            while True:
+                level = walk.send(self.raw_redis.mget(level))
+        except StopIteration:
+            pass
+
+    def _load_digest(self, raw_value, dbo_dict):
+        if self.codec.is_current(raw_value):
+            return value_digest(raw_value)
+        self.codec.legacy_loads += 1
+        if self.codec.migrate:
+            return None
+        # Match the value as the current codec would write it, so an unchanged object is not rewritten
+        return value_digest(self.codec.encode(dbo_dict))
+
+    def _decode_value(self, key, raw_value):
+        return self.codec.decode(self.codec.unpack(raw_value, key.partition(':')[0]))
+
+    def _load_zdicts(self):
+        for key_type, dict_id in self.redis.hgetall('codec:zdict_types').items():
+            zdict = self._load_zdict(dict_id)
+            if zdict:
+                self.codec.add_dictionary(key_type, zdict)
+
+    def _load_zdict(self, dict_id):
+        return self.raw_redis.hget('codec:zdicts', dict_id)
+
+    def _unresolved(self, dbo_keys, prefetched):
+        return {dbo_key for dbo_key in dbo_keys if dbo_key not in prefetched and dbo_key not in self._object_map}
+
+    def _dict_to_obj(self, dbo_dict, key_type, dbo_id):
         dbo = get_mixed_type(key_type, dbo_dict.get('mixins'))()
         dbo.dbo_id = dbo_id
         dbo.hydrate(dbo_dict)
+        if dbo.dbo_indexes:
+            dbo._dbo_ix = {ix_name: dbo_dict.get(ix_name) for ix_name in dbo.dbo_indexes}
         self._object_map[dbo.dbo_key] = dbo
         return dbo
 
-    def _update_indexes(self, dbo):
+    @property
+    def _writer(self):
+        return self.redis if self._batch_pipeline is None else self._batch_pipeline
+
+    def _flush_batch(self):
+        saves = list(self._batch_saves.values())
+        all_reads, results = self._read_pipeline(lambda reads: [self._queue_save_reads(dbo, reads) for dbo in saves])
+        results = iter(results)
+        save_results = [[next(results) for _ in range(read_count(save_reads))] for save_reads in all_reads]
+        applied = [save_reads[1] for save_reads, save_result in zip(all_reads, save_results) if save_reads and
+                   save_reads[1] and not save_result[-1]]
         try:
-            old_dbo = json_decode(self.redis.get(dbo.dbo_key))
-        except TypeError:
-            old_dbo = None
+            staged = [self._queue_save_writes(dbo, save_reads, save_result, self._batch_pipeline)
+                      for dbo, save_reads, save_result in zip(saves, all_reads, save_results)]
+        except NonUniqueError:
+            # Index updates run atomically on the server as they are read, so undo those made for this batch
+            self._revert_indexes(applied)
+            raise
+        self._execute_saves(self._batch_pipeline, staged)
+        log.debug("db batch flushed with {} object saves", len(saves))
+
+    def _abort_batch(self):
+        for dbo_key, dbo in self._batch_saves.items():
+            if dbo_key in self._batch_created:
+                self.evict_object(dbo)
+            else:
+                dbo.__dict__.pop('_dbo_digest', None)
+                dbo.__dict__.pop('_dbo_refs', None)
+
+    def _queue_save(self, dbo, pipeline, update_timestamp=False):
+        # All reads needed to maintain indexes and the reference graph are made in a single round trip,
+        # then every write is queued on the (transactional) pipeline supplied by the caller
+        if update_timestamp:
+            dbo.dbo_ts = int(time.time())
+        save_reads, results = self._read_pipeline(lambda reads: self._queue_save_reads(dbo, reads))
+        return self._queue_save_writes(dbo, save_reads, results, pipeline)
+
+    def _queue_save_reads(self, dbo, reads):
+        # The object is serialized first.  If the value matches the digest of the last value loaded or saved
+        # there is nothing to write, otherwise the reads needed for the write are queued.  The persisted
+        # references are only read on the first save of an object, after that they are tracked in memory.
+        # Index changes are checked and swapped atomically by a server side script.
+        save_root, new_refs = dbo.to_db_value()
+        raw_value = self.codec.encode(save_root)
+        digest = value_digest(raw_value)
+        ix_update = self._index_update(dbo) if dbo.dbo_indexes else None
+        if not ix_update and digest == getattr(dbo, '_dbo_digest', None):
+            self.writes_skipped += 1
+            self.bytes_skipped += len(raw_value)
+            return None
+        read_refs = not hasattr(dbo, '_dbo_refs')
+        if read_refs:
+            reads.smembers('{}:refs'.format(dbo.dbo_key))
+        if ix_update:
+            self._queue_ix_update(ix_update, reads)
+        return read_refs, ix_update, (raw_value, frozenset(new_refs), digest)
+
+    def _queue_save_writes(self, dbo, save_reads, results, pipeline):
+        # Returns the state to record on the object once the writes are executed, None if nothing is written
+        if not save_reads:
+            return
+        dbo_key = dbo.dbo_key
+        read_refs, ix_update, (raw_value, new_refs, digest) = save_reads
+        results = iter(results)
+        old_refs = next(results) if read_refs else dbo._dbo_refs
+        if ix_update:
+            self._check_ix_result(ix_update, next(results))
+        # Compression is deferred until here, so unchanged (skipped) saves never pay for it
+        raw_value = self.codec.pack(raw_value, dbo.dbo_key_type)
+        pipeline.set(dbo_key, raw_value)
+        self._queue_ref_changes(dbo_key, old_refs, new_refs, pipeline)
+        return dbo, new_refs, digest, ix_update, len(raw_value)
+
+    def _queue_delete(self, dbo, pipeline):
+        key = dbo.dbo_key
+        if self._batch_saves:
+            self._batch_saves.pop(key, None)
+        dbo.db_deleted()
+        pipeline.delete(key)
+        old_refs = getattr(dbo, '_dbo_refs', None)
+        if old_refs is None:
+            old_refs = self.fetch_set_keys('{}:refs'.format(key))
+        self._queue_clear_refs(key, old_refs, pipeline)
+        if dbo.dbo_set_key:
+            pipeline.srem(dbo.dbo_set_key, dbo.dbo_id)
+        for children_type in dbo.dbo_children_types:
+            child_set_key = "{}_{}s:{}".format(dbo.dbo_key_type, children_type, dbo.dbo_id)
+            for child in self.iter_object_set(get_dbo_class(children_type), child_set_key):
+                self._queue_delete(child, pipeline)
+            pipeline.delete(child_set_key)
+        old_values = getattr(dbo, '_dbo_ix', {})
+        for ix_name in dbo.dbo_indexes:
+            old_val = ix_value(old_values.get(ix_name, getattr(dbo, ix_name, None)))
+            if old_val != '':
+                pipeline.hdel('ix:{}:{}'.format(dbo.dbo_key_type, ix_name), old_val)
+        log.debug("object deleted: {}", key)
+        self.evict_object(dbo)
 
+    def _execute_saves(self, pipeline, staged):
+        try:
+            pipeline.execute()
+        except Exception:
+            self._revert_indexes(self._abandon_saves(staged))
+            raise
+        self._apply_saves(staged)
+
+    def _abandon_saves(self, staged):
+        # The writes may or may not have been applied, so the next save of each object reads the persisted
+        # references and writes the full value.  Index updates were made before the write, the ones to undo
+        # are returned.
+        staged = list(filter(None, staged))
+        for dbo, *_ in staged:
+            dbo.__dict__.pop('_dbo_digest', None)
+            dbo.__dict__.pop('_dbo_refs', None)
+        return [ix_update for *_, ix_update, _ in staged if ix_update]
+
+    def _apply_saves(self, staged):
+        for save in staged:
+            if save:
+                self._saved(*save)
+
+    def _saved(self, dbo, refs, digest, ix_update, size):
+        dbo._dbo_refs = refs
+        dbo._dbo_digest = digest
+        if ix_update:
+            dbo._dbo_ix = ix_update[2]
+        self.writes += 1
+        self.bytes_written += size
+        self._object_map[dbo.dbo_key] = dbo
+        self.dbo_cache.put(dbo.dbo_key, dbo, size)
+
+    def _read_pipeline(self, queue_reads):
+        # The index script is loaded at startup, but may be missing after a server restart or SCRIPT FLUSH
+        for attempt in range(2):
+            reads = self.redis.pipeline(transaction=False)
+            context = queue_reads(reads)
+            try:
+                return context, reads.execute()
+            except NoScriptError:
+                if attempt:
+                    raise
+                self._load_scripts()
+
+    def _load_scripts(self):
+        self._ix_sha = self.redis.script_load(IX_UPDATE_SCRIPT)
+
+    def _index_update(self, dbo):
+        old_values = getattr(dbo, '_dbo_ix', {})
+        ix_keys, ix_args = [], [dbo.dbo_id]
+        new_values = {}
         for ix_name in dbo.dbo_indexes:
-            new_val = getattr(dbo, ix_name, None)
-            old_val = old_dbo.get(ix_name) if old_dbo else None
-            if old_val == new_val:
-                continue
-            ix_key = 'ix:{}:{}'.format(dbo.dbo_key_type, ix_name)
-            if old_val is not None:
-                self.delete_index(ix_key, old_val)
-            if new_val is not None and new_val != '':
-                if self.get_index(ix_key, new_val):
-                    raise NonUniqueError(ix_key, new_val)
-                self.set_index(ix_key, new_val, dbo.dbo_id)
-
-    def _clear_old_refs(self, dbo):
-        dbo_key = dbo.dbo_key
+            new_val = ix_value(getattr(dbo, ix_name, None))
+            old_val = ix_value(old_values.get(ix_name))
+            new_values[ix_name] = new_val
+            if old_val != new_val:
+                ix_keys.append('ix:{}:{}'.format(dbo.dbo_key_type, ix_name))
+                ix_args.extend((old_val, new_val))
+        if ix_keys:
+            return ix_keys, ix_args, new_values
+        dbo._dbo_ix = new_values
+
+    def _queue_ix_update(self, ix_update, reads):
+        ix_keys, ix_args, _ = ix_update
+        reads.evalsha(self._ix_sha, len(ix_keys), *(ix_keys + ix_args))
+
+    def _check_ix_result(self, ix_update, result):
+        ix_keys, ix_args, _ = ix_update
+        if result:
+            raise NonUniqueError(ix_keys[result - 1], ix_args[result * 2])
+
+    def _revert_indexes(self, ix_updates):
+        if not ix_updates:
+            return
+        pipeline = self.redis.pipeline(transaction=False)
+        self._queue_index_reverts(ix_updates, pipeline)
+        try:
+            pipeline.execute()
+        except Exception:
+            log.exception("Failed to revert index updates {}", ix_updates)
+
+    def _queue_index_reverts(self, ix_updates, pipeline):
+        for ix_keys, ix_args, _ in ix_updates:
+            revert_args = [ix_args[0]]
+            for ix in range(1, len(ix_args), 2):
+                revert_args.extend((ix_args[ix + 1], ix_args[ix]))
+            pipeline.evalsha(self._ix_sha, len(ix_keys), *(ix_keys + revert_args))
+
+    def _queue_clear_refs(self, dbo_key, old_refs, pipeline):
+        for ref_id in old_refs:
+            pipeline.srem('{}:holders'.format(ref_id), dbo_key)
+        pipeline.delete('{}:refs'.format(dbo_key))
+
+    def _queue_ref_changes(self, dbo_key, old_refs, new_refs, pipeline):
+        # Only the difference from the persisted reference set is written, so an unchanged save costs nothing
+        added = new_refs.difference(old_refs)
+        removed = set(old_refs).difference(new_refs)
         ref_key = '{}:refs'.format(dbo_key)
-        for ref_id in self.fetch_set_keys(ref_key):
-            holder_key = '{}:holders'.format(ref_id)
-            self.delete_set_key(holder_key, dbo_key)
-        self.delete_key(ref_key)
+        if removed:
+            pipeline.srem(ref_key, *removed)
+            for ref_id in removed:
+                pipeline.srem('{}:holders'.format(ref_id), dbo_key)
+        if added:
+            pipeline.sadd(ref_key, *added)
+            for ref_id in added:
+                pipeline.sadd('{}:holders'.format(ref_id), dbo_key)
 
-    def _set_new_refs(self, dbo, new_refs):
-        dbo_key = dbo.dbo_key
-        self.add_set_key("{}:refs".format(dbo_key), *new_refs)
-        for ref_id in new_refs:
-            holder_key = '{}:holders'.format(ref_id)
-            self.add_set_key(holder_key, dbo_key)
+
+def split_key(dbo_key, key_type=None):
+    if key_type:
+        key_type = getattr(key_type, 'dbo_key_type', key_type)
+        return ':'.join((key_type, dbo_key)), key_type, dbo_key
+    key_type, _, dbo_id = dbo_key.partition(':')
+    return dbo_key, key_type, dbo_id
+
+
+def ix_value(value):
+    return '' if value is None else value
+
+
+def value_digest(raw_value):
+    return hashlib.sha1(raw_value).digest()
+
+
+def read_count(save_reads):
+    if not save_reads:
+        return 0
+    return save_reads[0] + bool(save_reads[1])
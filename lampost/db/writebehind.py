@@ -0,0 +1,98 @@
+import atexit
+import time
+
+from collections import OrderedDict
+
+from lampost.di.app import on_app_start
+from lampost.di.config import on_config_change, config_value
+from lampost.di.resource import Injected, module_inject
+
+log = Injected('log')
+ev = Injected('dispatcher')
+module_inject(__name__)
+
+
+class WriteBehindQueue:
+    """
+    Coalesces deferred object saves.  Objects queued with queue_save are written in one batch every
+    write_behind_interval seconds (a configuration value).  Queuing an object that is already pending
+    costs nothing, and a direct save of a pending object removes it from the queue.  With no interval
+    configured, queued objects are saved immediately.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.interval = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.max_depth = 0
+        self.last_latency = 0
+        self.max_latency = 0
+        self.total_latency = 0
+        self._pending = OrderedDict()
+        self._flush_reg = None
+        on_app_start(self._config)
+        on_config_change(self._config)
+        atexit.register(self.drain)
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def queue_save(self, dbo):
+        if not self.interval:
+            self.store.save_object(dbo, autosave=True)
+            return
+        self._pending[dbo.dbo_key] = dbo
+        self.max_depth = max(self.max_depth, len(self._pending))
+
+    def discard(self, dbo_key):
+        self._pending.pop(dbo_key, None)
+
+    def pop(self, dbo_key):
+        return self._pending.pop(dbo_key, None)
+
+    def flush(self):
+        if not self._pending:
+            return
+        start_time = time.time()
+        pending = list(self._pending.values())
+        self._pending.clear()
+        try:
+            with self.store.batch():
+                for dbo in pending:
+                    self.store.save_object(dbo, autosave=True)
+        except Exception:
+            # A single bad object should not lose every other pending write
+            log.exception("Write behind batch failed, saving objects individually")
+            for dbo in pending:
+                try:
+                    self.store.save_object(dbo, autosave=True)
+                except Exception:
+                    log.exception("Write behind save failed for {}", dbo.dbo_key)
+        latency = time.time() - start_time
+        self.flushes += 1
+        self.flushed += len(pending)
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self.total_latency += latency
+
+    def drain(self):
+        while self._pending:
+            self.flush()
+
+    def stats(self):
+        return {'depth': len(self._pending), 'max_depth': self.max_depth, 'interval': self.interval,
+                'flushes': self.flushes, 'flushed': self.flushed, 'last_latency': self.last_latency,
+                'max_latency': self.max_latency,
+                'avg_latency': self.total_latency / self.flushes if self.flushes else 0}
+
+    def _config(self):
+        self.interval = config_value('write_behind_interval', 0)
+        if self._flush_reg:
+            ev.unregister(self._flush_reg)
+            self._flush_reg = None
+        if self.interval:
+            self._flush_reg = ev.register_p(self.flush, seconds=self.interval, priority=1000)
+        else:
+            self.drain()
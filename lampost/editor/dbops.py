@@ -1,5 +1,8 @@
 import time
+import zlib
 
+from lampost.db.asyncstore import AsyncRedisStore
+from lampost.db.codec import train_dictionary
 from lampost.db.exceptions import DataError
 from lampost.di.resource import Injected, module_inject
 from lampost.di.config import load_yaml, activate
@@ -9,6 +12,8 @@ from lampost.db import dbconfig
 
 log = Injected('log')
 db = Injected('datastore')
+ev = Injected('dispatcher')
+sm = Injected('session_manager')
 perm = Injected('perm')
 module_inject(__name__)
 
@@ -20,16 +25,17 @@ def rebuild_indexes(class_id):
         raise DataError("Class not found")
     for ix_name in dbo_cls.dbo_indexes:
         db.delete_key('ix:{}:{}'.format(dbo_cls.dbo_key_type, ix_name))
-    for dbo_id in db.fetch_set_keys(dbo_cls.dbo_set_key):
-        try:
-            dbo_key = '{}:{}'.format(dbo_cls.dbo_key_type, dbo_id)
-            dbo_dict = db.load_value(dbo_key)
-            for ix_name in dbo_cls.dbo_indexes:
-                ix_value = dbo_dict.get(ix_name)
-                if ix_value is not None and ix_value != '':
-                    db.set_index('ix:{}:{}'.format(dbo_cls.dbo_key_type, ix_name), ix_value, dbo_id)
-        except (ValueError, TypeError):
-            log.warn("Missing dbo object {} from set key {}", dbo_id, dbo_cls.dbo_set_key)
+    for dbo_ids in db.scan_set(dbo_cls.dbo_set_key):
+        dbo_keys = ['{}:{}'.format(dbo_cls.dbo_key_type, dbo_id) for dbo_id in dbo_ids]
+        with db.batch():
+            for dbo_id, dbo_dict in zip(dbo_ids, db.load_values(dbo_keys)):
+                try:
+                    for ix_name in dbo_cls.dbo_indexes:
+                        ix_value = dbo_dict.get(ix_name)
+                        if ix_value is not None and ix_value != '':
+                            db.set_index('ix:{}:{}'.format(dbo_cls.dbo_key_type, ix_name), ix_value, dbo_id)
+                except (ValueError, TypeError, AttributeError):
+                    log.warn("Missing dbo object {} from set key {}", dbo_id, dbo_cls.dbo_set_key)
 
 
 @admin_op
@@ -44,22 +50,25 @@ def purge_invalid(confirm='no'):
     def purge(purge_cls, set_key=None):
         nonlocal purged, total
 
-        for dbo_id in db.fetch_set_keys(set_key):
-            total += 1
-            dbo_key = ':'.join((purge_cls.dbo_key_type, dbo_id))
-            dbo_dict = db.load_value(dbo_key)
-            if dbo_dict is None:
-                purged += 1
-                log.warn("Missing value for key {}", dbo_key)
-                if execute:
-                    db.delete_set_key(set_key, dbo_id)
-            else:
-                dbo = get_mixed_type(purge_cls.dbo_key_type, dbo_dict.get('mixins'))()
-                dbo.dbo_id = dbo_id
-                if not dbo.hydrate(dbo_dict):
-                    purged += 1
-                    if execute:
-                        db.delete_object(dbo)
+        for dbo_ids in db.scan_set(set_key):
+            dbo_keys = [':'.join((purge_cls.dbo_key_type, dbo_id)) for dbo_id in dbo_ids]
+            # Each chunk of the set is loaded with one MGET and its deletes are written in one batch
+            with db.batch():
+                for dbo_id, dbo_key, dbo_dict in zip(dbo_ids, dbo_keys, db.load_values(dbo_keys)):
+                    total += 1
+                    if dbo_dict is None:
+                        purged += 1
+                        log.warn("Missing value for key {}", dbo_key)
+                        if execute:
+                            db.delete_set_key(set_key, dbo_id)
+                        continue
+                    dbo = get_mixed_type(purge_cls.dbo_key_type, dbo_dict.get('mixins'))()
+                    dbo.dbo_id = dbo_id
+                    if not dbo.hydrate(dbo_dict):
+                        purged += 1
+                        if execute:
+                            db.delete_object(dbo)
+            for dbo_id in dbo_ids:
                 for child_type in getattr(dbo_cls, 'dbo_children_types', ()):
                     purge(get_dbo_class(child_type), '{}_{}s:{}'.format(dbo_key_type, child_type, dbo_id))
 
@@ -73,9 +82,7 @@ def purge_invalid(confirm='no'):
 
 @admin_op
 def rebuild_owner_refs():
-    # Yes, we're abusing the keys command.  If we required a later version of Redis (2.8) we could use SCAN
-    for owned_key in db.redis.keys('owned:*'):
-        db.delete_key(owned_key)
+    _delete_keys('owned:*')
     for dbo_cls in _dbo_registry.values():
         dbo_key_type = getattr(dbo_cls, 'dbo_key_type', None)
         if not dbo_key_type:
@@ -83,7 +90,7 @@ def rebuild_owner_refs():
         owner_field = dbo_cls.dbo_fields.get('owner_id', None)
         if not owner_field:
             continue
-        for dbo in db.load_object_set(dbo_cls):
+        for dbo in db.iter_object_set(dbo_cls):
             if dbo.owner_id in perm.immortals:
                 dbo.db_created()
             else:
@@ -92,10 +99,118 @@ def rebuild_owner_refs():
                 dbo.change_owner()
 
 
+@admin_op
+def dbo_cache_stats(reset='no'):
+    stats = db.dbo_cache.stats()
+    if reset == 'yes':
+        db.dbo_cache.reset_stats()
+    return stats
+
+
+@admin_op
+def db_save_stats(reset='no'):
+    stats = db.save_stats()
+    if reset == 'yes':
+        db.reset_save_stats()
+    return stats
+
+
+@admin_op
+def db_compress_stats(reset='no'):
+    stats = db.codec.compress_stats()
+    if reset == 'yes':
+        db.codec.reset_compress_stats()
+    return stats
+
+
+@admin_op
+def db_counter_stats(reset='no'):
+    stats = db.counters.stats()
+    if reset == 'yes':
+        db.counters.reset_stats()
+    return stats
+
+
+@admin_op
+def dispatch_stats(reset='no'):
+    stats = ev.dispatch_stats()
+    if reset == 'yes':
+        ev.reset_dispatch_stats()
+    return stats
+
+
+@admin_op
+def session_flush_stats(reset='no'):
+    stats = sm.flush_scheduler.stats()
+    if reset == 'yes':
+        sm.flush_scheduler.reset_stats()
+    return stats
+
+
+@admin_op
+def train_compression_dict(key_type, samples='200', size='32768'):
+    dbo_cls = get_dbo_class(key_type)
+    if not dbo_cls:
+        raise DataError("Class not found")
+    samples, size = int(samples), int(size)
+    set_key = getattr(dbo_cls, 'dbo_set_key', None)
+    if isinstance(set_key, str):
+        dbo_keys = ['{}:{}'.format(key_type, dbo_id) for dbo_id in db.redis.srandmember(set_key, samples)]
+    else:
+        dbo_keys = []
+        for scan_keys in db.scan_keys('{}:*'.format(key_type)):
+            dbo_keys.extend(scan_keys)
+            if len(dbo_keys) >= samples * 4:
+                break
+    encoded = []
+    for dbo_key, raw_value in zip(dbo_keys, db.raw_redis.mget(dbo_keys) if dbo_keys else ()):
+        if raw_value:
+            encoded.append(db.codec.encode(db._decode_value(dbo_key, raw_value)))
+    encoded = encoded[:samples]
+    if not encoded:
+        raise DataError("No stored values found for {}".format(key_type))
+    zdict = train_dictionary(encoded, size)
+    raw_bytes = sum(len(value) for value in encoded)
+    plain_bytes = sum(len(zlib.compress(value, db.codec.compress_level)) for value in encoded)
+    # Measured on the training samples themselves, so the dictionary ratio is optimistic
+    dict_bytes = 0
+    for value in encoded:
+        compressor = zlib.compressobj(db.codec.compress_level, zdict=zdict)
+        dict_bytes += len(compressor.compress(value) + compressor.flush())
+    dict_id = db.set_compression_dict(key_type, zdict)
+    return {'dict_id': dict_id, 'dict_bytes': len(zdict), 'samples': len(encoded), 'raw_bytes': raw_bytes,
+            'zlib_ratio': plain_bytes / raw_bytes, 'dict_ratio': dict_bytes / raw_bytes}
+
+
+@admin_op
+def db_pool_stats(reset='no'):
+    pools = {'pool': db.pool, 'raw_pool': db.raw_pool}
+    # The asyncio client has its own pools, sized like the synchronous ones
+    if isinstance(db.async_store, AsyncRedisStore):
+        pools['async_pool'] = db.async_store.pool
+        pools['async_raw_pool'] = db.async_store.raw_pool
+    gauges = {name: pool.gauges() for name, pool in pools.items()}
+    pool_gauges = list(gauges.values())
+    # Each client splits the configured connection limit between its text and raw pools
+    for gauge in 'max_connections', 'in_use':
+        gauges[gauge] = sum(gauge_values.get(gauge, 0) for gauge_values in pool_gauges)
+    if reset == 'yes':
+        for pool in pools.values():
+            pool.reset_gauges()
+    return gauges
+
+
+@admin_op
+def write_behind_stats(flush='no'):
+    if flush == 'yes':
+        db.write_queue.flush()
+    return db.write_queue.stats()
+
+
 @admin_op
 def rebuild_immortal_list():
     db.delete_key('immortals')
-    for player in db.load_object_set('player'):
+    for player in db.iter_object_set('player'):
         if player.imm_level:
             db.set_db_hash('immortals', player.dbo_id, player.imm_level)
 
@@ -107,16 +222,21 @@ def rebuild_all_fks():
 
     def update(update_cls, set_key=None):
         nonlocal updated
-        for dbo in db.load_object_set(update_cls, set_key):
-            db.save_object(dbo)
-            updated += 1
-            for child_type in getattr(dbo_cls, 'dbo_children_types', ()):
-                update(get_dbo_class(child_type), '{}_{}s:{}'.format(dbo_key_type, child_type, dbo.dbo_id))
-
-    for holder_key in db.redis.keys('*:holders'):
-        db.delete_key(holder_key)
-    for ref_key in db.redis.keys('*:refs'):
-        db.delete_key(ref_key)
+        set_key = set_key or update_cls.dbo_set_key
+        for dbo_ids in db.scan_set(set_key):
+            dbo_keys = [':'.join((update_cls.dbo_key_type, dbo_id)) for dbo_id in dbo_ids]
+            with db.batch():
+                dbos = [dbo for dbo in db.load_objects(dbo_keys, True) if dbo]
+                for dbo in dbos:
+                    db.save_object(dbo, force=True)
+            updated += len(dbos)
+            for dbo in dbos:
+                for child_type in getattr(dbo_cls, 'dbo_children_types', ()):
+                    update(get_dbo_class(child_type), '{}_{}s:{}'.format(dbo_key_type, child_type, dbo.dbo_id))
+
+    _delete_keys('*:holders')
+    _delete_keys('*:refs')
+    db.forget_refs()
     for dbo_cls in _dbo_registry.values():
         dbo_key_type = getattr(dbo_cls, 'dbo_key_type', None)
         if dbo_key_type and not hasattr(dbo_cls, 'dbo_parent_type'):
@@ -142,3 +262,9 @@ def restore_db_from_yaml(config_id='lampost', path='conf', force="no"):
     activate(db_config.section_values)
     return 'Config {} successfully loaded from yaml files'.format(config_id)
 
+
+def _delete_keys(pattern):
+    for keys in db.scan_keys(pattern):
+        with db.batch():
+            for key in keys:
+                db.delete_key(key)
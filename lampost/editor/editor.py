@@ -13,15 +13,19 @@ module_inject(__name__)
 
 
 def _reload_holders(holders, session):
-    for holder_key in holders:
-        holder = db.load_cached(holder_key)
-        if holder:
-            holder.reload()
-        else:
-            holder = db.load_object(holder_key)
-        if holder:
-            db.save_object(holder)
-            edit_update.publish_edit('update', holder, session, True)
+    reloaded = []
+    with db.batch():
+        for holder_key in holders:
+            holder = db.load_cached(holder_key)
+            if holder:
+                holder.reload()
+            else:
+                holder = db.load_object(holder_key)
+            if holder:
+                db.save_object(holder)
+                reloaded.append(holder)
+    for holder in reloaded:
+        edit_update.publish_edit('update', holder, session, True)
 
 
 def _edit_dto(dbo, player):
@@ -56,8 +60,12 @@ class Editor(LinkRouter):
                     all_holders.update(db.dbo_holders('{}:{}'.format(child_type, child_id)))
         return all_holders - all_dbo_keys
 
-    def list(self, player, **_):
-        return [_edit_dto(obj, player) for obj in db.load_object_set(self.key_type) if obj.can_read(player)]
+    async def list(self, player, **_):
+        dtos = []
+        async for obj in db.async_store.iter_object_set(self.key_type):
+            if obj.can_read(player):
+                dtos.append(_edit_dto(obj, player))
+        return dtos
 
     def create(self, session, player, obj_def, **_):
         if not self._permissions(player)['add']:
@@ -134,8 +142,8 @@ class ChildrenEditor(Editor):
         parent = db.load_object(parent_id, self.parent_type)
         perm.check_perm(session.player, parent)
 
-    def child_list(self, player, parent_id, **_):
-        parent = db.load_object(parent_id, self.parent_type)
+    async def child_list(self, player, parent_id, **_):
+        parent = await db.async_store.load_object(parent_id, self.parent_type)
         if not parent:
             raise NoRouteError(parent_id)
         if not parent.can_read(player):
@@ -143,7 +151,7 @@ class ChildrenEditor(Editor):
         set_key = '{}_{}s:{}'.format(self.parent_type, self.key_type, parent_id)
         can_write = parent.can_write(player)
         child_list = []
-        for child in db.load_object_set(self.key_type, set_key):
+        async for child in db.async_store.iter_object_set(self.key_type, set_key):
             child_dto = child.edit_dto
             child_dto['can_write'] = can_write
             child_list.append(child_dto)
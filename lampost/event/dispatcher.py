@@ -1,22 +1,35 @@
+import time
+
 from collections import defaultdict
 from random import randint
 
 from lampost.di.resource import Injected, module_inject
 from lampost.event.registration import Registration, PulseRegistration
+from lampost.event.wheel import TimingWheel
 
 log = Injected('log')
 module_inject(__name__)
 
 
 class Dispatcher:
+    """
+    Registrations for each event type are kept in a priority ordered tuple, rebuilt on the first dispatch after the
+    registrations for that type change.  Dispatch counts and cumulative callback time are kept per event type.
+    """
+
     def __init__(self):
         self._owner_map = defaultdict(set)
         self._registrations = defaultdict(set)
+        self._sorted = {}
+        self.reset_dispatch_stats()
 
     def register(self, event_type, callback, owner=None, priority=0):
         return self._add_registration(Registration(event_type, callback, owner, priority))
 
     def unregister(self, registration):
+        if registration.callback is None:
+            # Already unregistered, or a single pulse registration that has fired
+            return
         registration.cancel()
         owner_registrations = self._owner_map[registration.owner]
         owner_registrations.remove(registration)
@@ -26,6 +39,7 @@ class Dispatcher:
         event_registrations.remove(registration)
         if not event_registrations:
             del self._registrations[registration.event_type]
+        self._sorted.pop(registration.event_type, None)
         registration.owner = None
         registration.callback = None
 
@@ -35,12 +49,29 @@ class Dispatcher:
                 self.unregister(registration)
 
     def dispatch(self, event_type, *args, **kwargs):
-        sorted_events = sorted(self._registrations.get(event_type, []), key=lambda reg: reg.priority)
+        sorted_events = self._sorted.get(event_type)
+        if sorted_events is None:
+            if event_type not in self._registrations:
+                return
+            sorted_events = self._sorted[event_type] = tuple(sorted(self._registrations[event_type],
+                                                                    key=lambda reg: reg.priority))
+        start_time = time.perf_counter()
         for registration in sorted_events:
             try:
                 registration.callback(*args, **kwargs)
             except Exception:
                 log.exception("Dispatch Error", exc_info=True)
+        stats = self._dispatch_stats[event_type]
+        stats[0] += 1
+        stats[1] += time.perf_counter() - start_time
+
+    def reset_dispatch_stats(self):
+        self._dispatch_stats = defaultdict(lambda: [0, 0])
+
+    def dispatch_stats(self):
+        return {event_type: {'count': count, 'time': total_time,
+                             'listeners': len(self._registrations.get(event_type, ()))}
+                for event_type, (count, total_time) in self._dispatch_stats.items()}
 
     def detach_events(self, owner):
         if owner in self._owner_map:
@@ -49,16 +80,31 @@ class Dispatcher:
 
     def _add_registration(self, registration):
         self._registrations[registration.event_type].add(registration)
+        self._sorted.pop(registration.event_type, None)
         self._owner_map[registration.owner].add(registration)
         return registration
 
 
 class PulseDispatcher(Dispatcher):
+    """
+    Pulse registrations are scheduled on a TimingWheel.  Unregistering removes a registration from the wheel
+    immediately, a registration that is only cancelled is dropped when it comes due.  Single pulse registrations
+    are unregistered once they fire.  A registration with zero pulses is never called and is unregistered at its
+    due pulse.
+    """
+
     def __init__(self, pulses_per_second=10, start_pulse=0):
         super().__init__()
-        self._pulse_map = defaultdict(set)
+        self._wheel = TimingWheel(start_pulse)
         self.pulses_per_second = pulses_per_second
-        self.current_pulse = start_pulse
+
+    @property
+    def current_pulse(self):
+        return self._wheel.now
+
+    @current_pulse.setter
+    def current_pulse(self, pulse):
+        self._wheel.rebase(pulse)
 
     def register_p(self, callback, pulses=0, seconds=0, randomize=0, priority=0, repeat=True, kwargs=None):
         if seconds:
@@ -67,12 +113,17 @@ class PulseDispatcher(Dispatcher):
         if randomize:
             randomize = randint(0, randomize)
         registration = PulseRegistration(pulses, callback, priority=priority, repeat=repeat, kwargs=kwargs)
-        self._add_pulse(self.current_pulse + randomize, registration)
+        self._wheel.schedule(registration, self.current_pulse + randomize + pulses)
         return self._add_registration(registration)
 
     def register_once(self, *args, **kwargs):
         return self.register_p(repeat=False, *args, **kwargs)
 
+    def unregister(self, registration):
+        if isinstance(registration, PulseRegistration):
+            self._wheel.remove(registration)
+        super().unregister(registration)
+
     def future_pulse(self, seconds):
         return self.current_pulse + int(self.pulses_per_second * seconds)
 
@@ -81,16 +132,11 @@ class PulseDispatcher(Dispatcher):
 
     def pulse(self):
         self.dispatch('pulse')
-        for reg in sorted(self._pulse_map[self.current_pulse], key=lambda reg: reg.priority):
+        for reg in self._wheel.fire():
             if reg.freq:
                 try:
                     reg.callback(**reg.kwargs)
                 except Exception:
                     log.exception('Pulse Error')
-            if reg.repeat:
-                self._add_pulse(self.current_pulse, reg)
-        del self._pulse_map[self.current_pulse]
-        self.current_pulse += 1
-
-    def _add_pulse(self, start, event):
-        self._pulse_map[start + event.freq].add(event)
+            if reg.active and not (reg.repeat and reg.freq > 0):
+                self.unregister(reg)
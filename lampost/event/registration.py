@@ -11,13 +11,16 @@ class Registration:
 
 class PulseRegistration(Registration):
     kwargs = {}
+    _slot = None
+    _due = 0
 
     def __init__(self, freq, callback, owner=None, priority=0, repeat=True, kwargs=None):
         super().__init__('pulse_i', callback, owner, priority)
         self.freq = freq
         self.repeat = repeat
+        self.active = True
         if kwargs:
             self.kwargs = kwargs
 
     def cancel(self):
-        self.freq = 0
+        self.active = False
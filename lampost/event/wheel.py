@@ -0,0 +1,168 @@
+from bisect import insort
+
+# Slot bits for each level of the wheel.  Level 0 slots are single pulses, a level n slot spans every pulse of
+# the level n - 1 wheel.  At 10 pulses per second level 0 covers about 7 minutes, so most timers never cascade,
+# and the four levels together cover about 3 years.
+LEVEL_BITS = (12, 6, 6, 6)
+
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel holding PulseRegistrations by due pulse.  Scheduling and cancelling are O(1): a
+    registration is stored in a single dictionary slot, which it remembers so it can remove itself.  Registrations
+    due far in the future wait in coarse slots and cascade down a level each time the lower wheel wraps.
+
+    Level 0 has a separate ring of slots for each priority, and the priorities in use are kept sorted, so a pulse
+    fires its registrations in priority order without sorting them.
+    """
+
+    def __init__(self, now=0):
+        self._reset(now)
+
+    def _reset(self, now):
+        self.now = now
+        self._shifts = []
+        self._masks = []
+        self._spans = []
+        self._levels = [None]
+        shift = 0
+        for level, bits in enumerate(LEVEL_BITS):
+            self._shifts.append(shift)
+            self._masks.append((1 << bits) - 1)
+            if level:
+                self._levels.append([{} for _ in range(1 << bits)])
+            shift += bits
+            self._spans.append(1 << shift)
+        self._span_0 = self._spans[0]
+        self._mask_0 = self._masks[0]
+        self._horizon = 1 << shift
+        self._overflow = {}
+        self._priorities = []
+        self._rings = {}
+        self._firing = None
+
+    def schedule(self, reg, due):
+        now = self.now
+        if self._firing is not None:
+            now += 1
+        delay = due - now
+        if delay < 0:
+            due, delay = now, 0
+        if delay < self._span_0:
+            try:
+                ring = self._rings[reg.priority]
+            except KeyError:
+                ring = self._add_ring(reg.priority)
+            slot = ring[due & self._mask_0]
+        else:
+            reg._due = due
+            slot = self._upper_slot(due, delay)
+        slot[reg] = None
+        reg._slot = slot
+
+    def remove(self, reg):
+        slot = reg._slot
+        if slot is not None:
+            reg._slot = None
+            # The slot being fired has already been taken off the wheel
+            if slot is not self._firing:
+                del slot[reg]
+
+    def fire(self):
+        """
+        Generator for the registrations due at the current pulse, in priority order.  Cancelled registrations are
+        skipped, and a repeating registration with a positive frequency is rescheduled when control returns to the
+        generator, unless it has been cancelled.  The wheel advances to the next pulse when the generator finishes.
+        """
+        now = self.now
+        span_0 = self._span_0
+        mask_0 = self._mask_0
+        if not now & mask_0:
+            self._cascade(now)
+        ix = now & mask_0
+        try:
+            for priority in self._priorities:
+                ring = self._rings[priority]
+                slot = ring[ix]
+                if not slot:
+                    continue
+                ring[ix] = {}
+                self._firing = slot
+                for reg in slot:
+                    if not reg.active:
+                        reg._slot = None
+                        continue
+                    yield reg
+                    freq = reg.freq
+                    if reg.repeat and reg.active and freq > 0:
+                        if freq < span_0:
+                            next_slot = ring[(now + freq) & mask_0]
+                            next_slot[reg] = None
+                            reg._slot = next_slot
+                        else:
+                            reg._due = due = now + freq
+                            next_slot = reg._slot = self._upper_slot(due, freq)
+                            next_slot[reg] = None
+        finally:
+            self._firing = None
+            self.now = now + 1
+
+    def rebase(self, now):
+        """
+        Moves the wheel to a new current pulse, keeping the remaining delay of every scheduled registration
+        """
+        scheduled = list(self.scheduled())
+        offset = now - self.now
+        self._reset(now)
+        for reg, due in scheduled:
+            self.schedule(reg, due + offset)
+
+    def scheduled(self):
+        """
+        Yields (registration, due pulse) for every scheduled registration
+        """
+        now = self.now
+        mask_0 = self._mask_0
+        for ring in self._rings.values():
+            for ix, slot in enumerate(ring):
+                for reg in slot:
+                    yield reg, now + ((ix - now) & mask_0)
+        for slot in self._upper_slots():
+            for reg in slot:
+                yield reg, reg._due
+
+    def __len__(self):
+        return sum(map(len, self._upper_slots())) + sum(len(slot) for ring in self._rings.values() for slot in ring)
+
+    def _add_ring(self, priority):
+        ring = self._rings[priority] = [{} for _ in range(self._span_0)]
+        insort(self._priorities, priority)
+        return ring
+
+    def _upper_slots(self):
+        yield self._overflow
+        for level in self._levels[1:]:
+            yield from level
+
+    def _upper_slot(self, due, delay):
+        if delay >= self._horizon:
+            return self._overflow
+        level = 1
+        while delay >= self._spans[level]:
+            level += 1
+        return self._levels[level][(due >> self._shifts[level]) & self._masks[level]]
+
+    def _cascade(self, now):
+        # Every lower wheel that wraps at this pulse is refilled from the next level up, highest level first
+        top = len(LEVEL_BITS) - 1
+        for level in range(top, 0, -1):
+            if not now & (self._spans[level - 1] - 1):
+                if level == top and not now & (self._horizon - 1):
+                    self._reinsert(self._overflow)
+                self._reinsert(self._levels[level][(now >> self._shifts[level]) & self._masks[level]])
+
+    def _reinsert(self, slot):
+        regs = list(slot)
+        slot.clear()
+        for reg in regs:
+            self.schedule(reg, reg._due)
@@ -1,6 +1,10 @@
+from lampost.util.classes import subclasses
+
+
 class CoreMeta(type):
 
     def __init__(cls, name, bases, new_attrs):
+        type.__setattr__(cls, '_mro_hooks', {})
         cls._meta_init_attrs(new_attrs)
         cls._extend(bases, "_cls_inits", "_cls_init")
         for cls_init in cls._cls_inits:
@@ -11,6 +15,20 @@ class CoreMeta(type):
             if mixin_init not in cls._cls_inits:
                 cls._cls_inits.append(mixin_init)
 
+    def __setattr__(cls, name, value):
+        super().__setattr__(name, value)
+        cls._clear_hooks()
+
+    def __delattr__(cls, name):
+        super().__delattr__(name)
+        cls._clear_hooks()
+
+    def _clear_hooks(cls):
+        # call_mro hook chains for this class and every subclass may include the changed attribute
+        cls._mro_hooks.clear()
+        for subclass in subclasses(cls):
+            subclass._mro_hooks.clear()
+
     @staticmethod
     def _meta_init_attrs(new_attrs):
         for name, attr in new_attrs.items():
@@ -1,12 +1,15 @@
+from collections import deque
+
 from lampost.server.services import ClientService
 from lampost.gameops.action import make_action
 from lampost.di.resource import Injected, module_inject
-from lampost.di.config import config_value
+from lampost.di.config import on_config_change, config_value
 from lampost.util.lputil import timestamp
 
 ev = Injected('dispatcher')
 db = Injected('datastore')
 cs = Injected('channel_service')
+sm = Injected('session_manager')
 module_inject(__name__)
 
 
@@ -41,11 +44,21 @@ class Channel():
 
 
 class ChannelService(ClientService):
+    """
+    Recent messages for each channel are kept in memory, newest first, up to max_channel_history entries.  The
+    Redis list for a channel is read once per process, after that subscribing costs no database calls, and every
+    message is pushed and trimmed to the same length in a single transaction.  The subscribe output for a channel
+    is encoded once and shared by every subscriber until the next message.
+    """
 
     def _start(self):
         super()._start()
         self.all_channels = db.fetch_set_keys('all_channels')
         self.general_channels = db.fetch_set_keys('general_channels')
+        self._history = {}
+        self._subscribe_output = {}
+        self._config()
+        on_config_change(self._config)
         ev.register('maintenance', self._prune_channels)
         ev.register('session_connect', self._session_connect)
         ev.register('player_connect', self._player_connect)
@@ -62,23 +75,42 @@ class ChannelService(ClientService):
         db.delete_set_key('all_channels', channel_id)
         self.all_channels.discard(channel_id)
         self.general_channels.discard(channel_id)
+        self._history.pop(channel_id, None)
+        self._subscribe_output.pop(channel_id, None)
 
     def dispatch_message(self, channel_id, text):
         message = {'id': channel_id, 'text': text}
         timestamp(message)
-        for session in self.sessions:
-            if channel_id in session.channel_ids:
-                session.append({'channel': message})
-        db.add_db_list(channel_key(channel_id), {'text': text, 'timestamp': message['timestamp']})
+        sm.broadcast((session for session in self.sessions if channel_id in session.channel_ids),
+                     {'channel': message})
+        entry = {'text': text, 'timestamp': message['timestamp']}
+        self._channel_history(channel_id).appendleft(entry)
+        self._subscribe_output.pop(channel_id, None)
+        db.add_db_list(channel_key(channel_id), entry, self.max_history)
 
     def add_sub(self, session, channel_id):
         session.channel_ids.add(channel_id)
-        session.append({'channel_subscribe': {'id': channel_id, 'messages': db.get_db_list(channel_key(channel_id))}})
+        try:
+            fragment = self._subscribe_output[channel_id]
+        except KeyError:
+            fragment = sm.OutputFragment({'channel_subscribe': {'id': channel_id,
+                                                                'messages': list(self._channel_history(channel_id))}})
+            self._subscribe_output[channel_id] = fragment
+        session.append_fragment(fragment)
 
     def remove_sub(self, session, channel_id):
         session.channel_ids.remove(channel_id)
         session.append({'channel_unsubscribe': channel_id})
 
+    def _channel_history(self, channel_id):
+        try:
+            return self._history[channel_id]
+        except KeyError:
+            pass
+        history = deque(db.get_db_list(channel_key(channel_id), 0, self.max_history - 1), self.max_history)
+        self._history[channel_id] = history
+        return history
+
     def _session_connect(self, session, *_):
         self.register(session, None)
         if not hasattr(session, 'channel_ids'):
@@ -101,8 +133,16 @@ class ChannelService(ClientService):
         self._session_connect(session)
 
     def _prune_channels(self):
+        # Lists are trimmed on every push, this catches lists written before max_channel_history was reduced
         for channel_id in self.all_channels:
-            db.trim_db_list(channel_key(channel_id), 0, config_value('max_channel_history'))
+            db.trim_db_list(channel_key(channel_id), 0, self.max_history - 1)
+
+    def _config(self):
+        self.max_history = max(config_value('max_channel_history', 100), 1)
+        self._subscribe_output.clear()
+        for channel_id, history in self._history.items():
+            if history.maxlen != self.max_history:
+                self._history[channel_id] = deque(history, self.max_history)
 
 
 def channel_key(channel_id):
@@ -57,7 +57,7 @@ class LinkHandler(WebSocketHandler):
     def on_open(self):
         pass
 
-    def on_message(self, message):
+    async def on_message(self, message):
         cmd = json_decode(message)
         req_id = cmd.get('req_id', None)
         path = cmd.get('path', None)
@@ -74,6 +74,8 @@ class LinkHandler(WebSocketHandler):
             cmd['player'] = player
             cmd['socket'] = self
             data = route.handler(**cmd)
+            if inspect.isawaitable(data):
+                data = await data
             if req_id is None:
                 if data is not None:
                     self.write_message(json_encode(data))
@@ -111,6 +113,7 @@ class LinkRouter():
                 _routes[route_path] = LinkRoute(self._router, imm_level)
 
     def _router(self, path, **kwargs):
+        # Coroutine methods return an awaitable, which the LinkHandler awaits before responding
         self._pre_route()
         try:
             method_name = path.split('/')[-1]
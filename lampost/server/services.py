@@ -41,22 +41,69 @@ class ClientService():
             pass
 
     def _session_dispatch(self, event):
-        for session in self.sessions:
-            session.append(event)
+        sm.broadcast(self.sessions, event)
 
 
 class PlayerListService(ClientService):
+    """
+    Sends the full player list when a session registers, then only the entries added, changed or removed since the
+    previous broadcast.  Added and changed entries replace any existing entry for that player.  A session with no
+    socket when a broadcast happens has fallen behind, and is sent a new full list when it reconnects.
+    """
 
     def _start(self):
         super()._start()
+        self._last_list = {}
+        self._stale = set()
         ev.register('player_list', self._process_list)
+        ev.register('session_connect', self._session_connect)
 
     def register(self, session, data=None):
         super().register(session, data)
-        session.append({'player_list': sm.player_info_map()})
+        self._stale.discard(session)
+        session.append({'player_list': sm.player_info_map().copy()})
+
+    def unregister(self, session):
+        super().unregister(session)
+        self._stale.discard(session)
+
+    def _session_connect(self, session, *_):
+        if session in self._stale:
+            self._stale.remove(session)
+            session.append({'player_list': sm.player_info_map().copy()})
 
     def _process_list(self, player_list):
-        self._session_dispatch({'player_list': player_list})
+        delta = self._player_delta(player_list)
+        if not delta:
+            return
+        current = []
+        snapshot = []
+        for session in self.sessions:
+            if not session.socket:
+                self._stale.add(session)
+            elif session in self._stale:
+                self._stale.remove(session)
+                snapshot.append(session)
+            else:
+                current.append(session)
+        sm.broadcast(current, {'player_list_delta': delta})
+        if snapshot:
+            sm.broadcast(snapshot, {'player_list': player_list.copy()})
+
+    def _player_delta(self, player_list):
+        last_list = self._last_list
+        added = {}
+        changed = {}
+        for player_id, info in player_list.items():
+            last_info = last_list.get(player_id)
+            if last_info is None:
+                added[player_id] = info
+            elif last_info != info:
+                changed[player_id] = info
+        removed = [player_id for player_id in last_list if player_id not in player_list]
+        self._last_list = player_list.copy()
+        if added or changed or removed:
+            return {'added': added, 'changed': changed, 'removed': removed}
 
 
 class AnyLoginService(ClientService):
@@ -1,4 +1,6 @@
 import time
+
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from os import urandom
 from base64 import b64encode
@@ -25,9 +27,88 @@ _link_dead_prune = 0
 _link_dead_interval = 0
 
 
+class FlushScheduler:
+    """
+    Sends pending session output once per pulse.  Appending output marks a session dirty, and the dirty sessions
+    are flushed in the order they were marked from a single pulse registration.  If session_flush_max (a
+    configuration value) is set, at most that many sessions are flushed each pulse and the rest wait for the next.
+    Latency is measured from the first output appended to a session until it is flushed.
+    """
+
+    def __init__(self):
+        self.max_flush = 0
+        self._dirty = OrderedDict()
+        self.reset_stats()
+
+    def schedule(self, session):
+        if session not in self._dirty:
+            self._dirty[session] = time.time()
+
+    def discard(self, session):
+        self._dirty.pop(session, None)
+
+    def flush(self):
+        if not self._dirty:
+            return
+        now = time.time()
+        count = len(self._dirty)
+        if self.max_flush and count > self.max_flush:
+            self.deferred += count - self.max_flush
+            count = self.max_flush
+        for _ in range(count):
+            session, queued_time = self._dirty.popitem(last=False)
+            try:
+                session.flush()
+            except Exception:
+                log.exception("Session flush failed")
+            latency = now - queued_time
+            self.max_latency = max(self.max_latency, latency)
+            self.total_latency += latency
+        self.pulses += 1
+        self.flushed += count
+
+    def reset_stats(self):
+        self.pulses = self.flushed = self.deferred = 0
+        self.max_latency = self.total_latency = 0
+
+    def stats(self):
+        return {'depth': len(self._dirty), 'max_flush': self.max_flush, 'pulses': self.pulses,
+                'flushed': self.flushed, 'deferred': self.deferred, 'max_latency': self.max_latency,
+                'avg_latency': self.total_latency / self.flushed if self.flushed else 0}
+
+
+flush_scheduler = FlushScheduler()
+
+
+class OutputFragment:
+    """
+    Output shared by many sessions, such as a broadcast.  The data is JSON encoded once, the first time a session
+    holding the fragment is flushed, and the encoded text is spliced into the output of every other session.  The
+    data should not be changed after the fragment is appended.
+    """
+    __slots__ = ('data', '_encoded')
+
+    def __init__(self, data):
+        self.data = data
+        self._encoded = None
+
+    @property
+    def encoded(self):
+        if self._encoded is None:
+            self._encoded = json_encode(self.data)
+        return self._encoded
+
+
+def broadcast(sessions, data):
+    fragment = OutputFragment(data)
+    for session in sessions:
+        session.append_fragment(fragment)
+
+
 @on_app_start
 def _on_app_start():
     ev.register('player_logout', _player_logout)
+    ev.register('pulse', flush_scheduler.flush, priority=1000)
     _config()
 
 
@@ -96,6 +177,8 @@ def _config():
     _link_status_reg = ev.register_p(_check_link_status, seconds=check_link_interval)
     _broadcast_reg = ev.register_p(_broadcast_status, seconds=config_value('broadcast_interval'))
 
+    flush_scheduler.max_flush = config_value('session_flush_max', 0)
+
     _link_dead_prune = timedelta(seconds=config_value('link_dead_prune'))
     _link_dead_interval = timedelta(seconds=config_value('link_dead_interval'))
 
@@ -129,12 +212,21 @@ def _reconnect_session(session_id, player_id):
     session.append({'login': client_data})
     ev.dispatch('user_connect', session.user, client_data)
     ev.dispatch('player_connect', session.player, client_data)
+    if any(_has_key(item, 'player_list') for item in session._output):
+        # The full player list sent on connect is newer than any player list delta left in the stale output
+        stale_output = [item for item in stale_output if not _has_key(item, 'player_list_delta')]
     session.append_list(stale_output)
     session.player.display_line("-- Reconnecting Session --", 'system')
     session.player.parse("look")
     return session
 
 
+def _has_key(item, key):
+    if isinstance(item, OutputFragment):
+        item = item.data
+    return isinstance(item, dict) and key in item
+
+
 def _start_player(session, player_id):
     old_session = player_session(player_id)
     if old_session and old_session != session:
@@ -209,13 +301,13 @@ def _broadcast_status():
 
 class ClientSession(Attachable):
     def _on_attach(self):
-        self._pulse_reg = None
         self.attach_time = datetime.now()
         self.socket = None
         self.ld_time = None
         self._reset()
 
     def _on_detach(self):
+        flush_scheduler.discard(self)
         ev.dispatch('session_disconnect', self)
 
     def attach_socket(self, socket):
@@ -232,6 +324,11 @@ class ClientSession(Attachable):
         self._output += data
         self._schedule()
 
+    def append_fragment(self, fragment):
+        self._output.append(fragment)
+        self._fragments = True
+        self._schedule()
+
     def link_failed(self, reason):
         log.debug("Link failed {}", reason)
         self.ld_time = datetime.now()
@@ -239,24 +336,44 @@ class ClientSession(Attachable):
 
     def pull_output(self):
         output = self._output
-        if self._pulse_reg:
-            ev.unregister(self._pulse_reg)
-            self._pulse_reg = None
+        if self._fragments:
+            output = [item.data if isinstance(item, OutputFragment) else item for item in output]
+        flush_scheduler.discard(self)
         self._reset()
         return output
 
     def flush(self):
         if self.socket:
-            output = self.pull_output()
-            self.socket.write_message(json_encode(output))
+            output = self._output
+            fragments = self._fragments
+            flush_scheduler.discard(self)
+            self._reset()
+            self.socket.write_message(self._encode(output) if fragments else json_encode(output))
+
+    @staticmethod
+    def _encode(output):
+        # Consecutive plain items are encoded together, fragments are spliced in already encoded
+        parts = []
+        plain = []
+        for item in output:
+            if isinstance(item, OutputFragment):
+                if plain:
+                    parts.append(json_encode(plain)[1:-1])
+                    plain = []
+                parts.append(item.encoded)
+            else:
+                plain.append(item)
+        if plain:
+            parts.append(json_encode(plain)[1:-1])
+        return '[{}]'.format(','.join(parts))
 
     def _schedule(self):
-        if not self._pulse_reg:
-            self._pulse_reg = ev.register("pulse", self.flush)
+        flush_scheduler.schedule(self)
 
     def _reset(self):
         self._lines = []
         self._output = []
+        self._fragments = False
         self._status = None
 
 
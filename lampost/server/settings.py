@@ -22,10 +22,10 @@ link_module(__name__)
 lampost_title = ConfigVal('lampost_title')
 
 
-def get_account(session, player, user_id, **_):
+async def get_account(session, player, user_id, **_):
     if session.user.dbo_id != user_id:
         perm.check_perm(player, 'admin')
-    return db.load_object(user_id, "user").edit_dto
+    return (await db.async_store.load_object(user_id, "user")).edit_dto
 
 
 def create_account(session, account_name, password, email=None, **_):
@@ -78,20 +78,20 @@ def create_player(user_id, player_name, player_data, **_):
     um.attach_player(user, player)
 
 
-def get_players(user_id, **_):
-    user = db.load_object(user_id, "user")
+async def get_players(user_id, **_):
+    user = await db.async_store.load_object(user_id, "user")
     if not user:
         raise ClientError("User {} does not exist".format(user_id))
-    return _player_list(user.player_ids)
+    return await _player_list(user.player_ids)
 
 
-def delete_player(session, player_id, password, **_):
+async def delete_player(session, player_id, password, **_):
     user = session.user
     um.validate_password(user, password)
     if not player_id in user.player_ids:
         raise ClientError("Player {} longer associated with user".format(player_id))
     um.delete_player(user, player_id)
-    return _player_list(user.player_ids)
+    return await _player_list(user.player_ids)
 
 
 def update_display(session, displays, **_):
@@ -147,9 +147,8 @@ def notifies(session, notifies, **_):
     friend_service.update_notifies(user.dbo_id, user.notifies)
 
 
-def _player_list(player_ids):
-    players = []
-    for player_id in player_ids:
-        player = db.load_object(player_id, "player")
-        players.append({'name': player.name, 'dbo_id': player.dbo_id})
-    return players
+async def _player_list(player_ids):
+    # The player loads are issued together, so they are fetched with a single MGET
+    player_keys = ['player:{}'.format(player_id) for player_id in player_ids]
+    return [{'name': player.name, 'dbo_id': player.dbo_id} for player in
+            await db.async_store.load_objects(player_keys) if player]
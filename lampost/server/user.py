@@ -68,12 +68,13 @@ def delete_player(user, player_id):
 
 
 def attach_player(user, player):
-    user.player_ids.append(player.dbo_id)
-    db.set_index('ix:player:user', player.dbo_id, user.dbo_id)
-    ev.dispatch('player_create', player, user)
-    player.user_id = user.dbo_id
-    db.save_object(player)
-    db.save_object(user)
+    with db.batch():
+        user.player_ids.append(player.dbo_id)
+        db.set_index('ix:player:user', player.dbo_id, user.dbo_id)
+        ev.dispatch('player_create', player, user)
+        player.user_id = user.dbo_id
+        db.save_object(player)
+        db.save_object(user)
     return player
 
 
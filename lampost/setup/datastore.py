@@ -0,0 +1,9 @@
+from lampost.db.redisstore import RedisStore
+
+
+def create_datastore(args):
+    if args.db_type == 'memory':
+        from lampost.db.memorystore import MemoryStore
+        return MemoryStore(args.db_snapshot, args.db_snapshot_interval)
+    return RedisStore(args.db_host, args.db_port, args.db_num, args.db_pw, args.db_pool, args.db_pool_timeout,
+                      args.db_keepalive)
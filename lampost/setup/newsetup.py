@@ -3,7 +3,8 @@ from importlib import import_module
 from lampost.event.dispatcher import PulseDispatcher
 from lampost.util import json
 from lampost.di import resource, config, app
-from lampost.db import redisstore, permissions, dbconfig
+from lampost.db import permissions, dbconfig
+from lampost.setup.datastore import create_datastore
 from lampost.server import user as user_manager
 
 log = resource.get_resource('log').factory('setup')
@@ -12,9 +13,9 @@ log = resource.get_resource('log').factory('setup')
 def new_setup(args):
     json.select_json()
 
-    db = resource.register('datastore', redisstore.RedisStore(args.db_host, args.db_port, args.db_num, args.db_pw))
+    db = resource.register('datastore', create_datastore(args))
     if args.flush:
-        db_num = db.pool.connection_kwargs['db']
+        db_num = getattr(db.pool, 'connection_kwargs', {}).get('db', args.db_num)
         if db_num == args.db_num:
             log.info("Flushing database {}", db_num)
             db.redis.flushdb()
@@ -12,10 +12,21 @@ log_group.add_argument('-lf', '--log_file', help="log output file", default=None
 log_group.add_argument('-lm', '--log_mode', help="log file open mode", default='w')
 
 db_group = parent_parser.add_argument_group(title="Redis Database Configuration")
+db_group.add_argument('-db_type', help="datastore type, memory keeps all data in process", choices=['redis', 'memory'],
+                      default='redis')
+db_group.add_argument('-db_snapshot', help="memory datastore snapshot file", default=None)
+db_group.add_argument('-db_snapshot_interval', help="seconds between memory datastore snapshots, 0 to only save on exit",
+                      type=int, default=300)
 db_group.add_argument('-db_host', help="database server host name", default='localhost')
 db_group.add_argument('-db_port', help="database server port", type=int, default=6379)
 db_group.add_argument('-db_num', help="Redis database number", type=int, default=0)
 db_group.add_argument('-db_pw', help="Redis database password", default=None)
+db_group.add_argument('-db_pool', help="maximum Redis connections, split evenly between text and binary connections",
+                      type=int, default=8)
+db_group.add_argument('-db_pool_timeout', help="seconds to wait for a free Redis connection (uses a blocking pool)",
+                      type=float, default=None)
+db_group.add_argument('-db_keepalive', help="enable TCP keepalive on Redis connections", const=True, default=False,
+                      action='store_const')
 
 
 main_parser = argparse.ArgumentParser(parents=[parent_parser], formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -43,6 +54,11 @@ imm_group.add_argument('-ipw', '--imm_password', help="root account password", d
 tools_parser = argparse.ArgumentParser(parents=[parent_parser], formatter_class=argparse.ArgumentDefaultsHelpFormatter,
                                        description="lampost_tools -- Some command line tools for lampost")
 tools_parser.add_argument('op', metavar="OPERATION", help="Tools operation")
+tools_parser.add_argument('-df', '--dump_file', help="export_db/import_db dump file, gzip compressed if it ends in .gz",
+                          default='lampost.dump')
+tools_parser.add_argument('-dc', '--dump_chunk', help="keys or collection items per pipelined read or write",
+                          type=int, default=1000)
+tools_parser.add_argument('-dw', '--dump_workers', help="import_db worker processes", type=int, default=1)
 
 
 
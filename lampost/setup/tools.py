@@ -1,7 +1,14 @@
+import gzip
+import json as stdjson
 import logging
+import time
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 from lampost.di import resource, config
-from lampost.db.redisstore import RedisStore
+from lampost.setup.datastore import create_datastore
 from lampost.db import dbconfig
 from lampost.util.logging import LogFactory
 from lampost.util import json
@@ -12,7 +19,7 @@ log = logging.getLogger(__name__)
 
 
 def reload_config(args):
-    db = RedisStore(args.db_host, args.db_port, args.db_num, args.db_pw)
+    db = create_datastore(args)
     resource.register('datastore', db)
     config_id = args.config_id
     existing = db.load_object(config_id, dbconfig.Config)
@@ -34,3 +41,176 @@ def reload_config(args):
         return
     config.activate(db_config.section_values)
     print('Config {} successfully reloaded from yaml files'.format(config_id))
+
+
+DUMP_HEADER = '# lampost dump 1'
+
+# Each dump line is "<type code>\t<json key>\t<json value>".  Large collections are split over several lines,
+# the first line for a key has an upper case type code so the importer replaces any existing value.
+_dump_types = {'string': 's', 'set': 'e', 'hash': 'h', 'list': 'l'}
+
+
+def export_db(args):
+    db = create_datastore(args)
+    chunk = args.dump_chunk
+    meter = DumpMeter('Exported')
+    with _open_dump(args.dump_file, 'w') as dump:
+        dump.write(DUMP_HEADER + '\n')
+        for keys in db.scan_keys(count=chunk):
+            pipeline = db.redis.pipeline(transaction=False)
+            for key in keys:
+                pipeline.type(key)
+            key_types = pipeline.execute()
+            pipeline = db.raw_redis.pipeline(transaction=False)
+            for key, key_type in zip(keys, key_types):
+                _queue_dump_read(pipeline, key, key_type, chunk)
+            for key, key_type, value in zip(keys, key_types, pipeline.execute()):
+                if key_type not in _dump_types:
+                    continue
+                cursor = 0
+                if key_type == 'set' or key_type == 'hash':
+                    cursor, value = value
+                elif key_type == 'list' and len(value) == chunk:
+                    cursor = chunk
+                if not value:
+                    continue
+                type_code = _dump_types[key_type]
+                meter.add(1, dump.write(_dump_line(type_code.upper(), key, key_type, value)))
+                if int(cursor):
+                    for more in _dump_remainder(db, key, key_type, cursor, chunk):
+                        meter.add(0, dump.write(_dump_line(type_code, key, key_type, more)))
+    meter.report()
+
+
+def import_db(args):
+    workers = max(args.dump_workers, 1)
+    if workers == 1 or args.db_type == 'memory':
+        totals = [_import_worker(args, 0, 1)]
+    else:
+        # Workers split the key space by hash, so every line for a key is written in order by one worker
+        with ProcessPoolExecutor(workers) as executor:
+            totals = list(executor.map(_import_worker, repeat(args, workers), range(workers), repeat(workers, workers)))
+    meter = DumpMeter('Imported')
+    for keys, size, _ in totals:
+        meter.add(keys, size)
+    meter.start_time = min(start_time for _, _, start_time in totals)
+    meter.report()
+
+
+def _import_worker(args, worker, workers):
+    db = create_datastore(args)
+    chunk = args.dump_chunk
+    meter = DumpMeter('Worker {} imported'.format(worker) if workers > 1 else 'Imported')
+    pipeline = db.raw_redis.pipeline(transaction=False)
+    with _open_dump(args.dump_file, 'r') as dump:
+        if dump.readline().rstrip('\n') != DUMP_HEADER:
+            raise ValueError("{} is not a lampost dump file".format(args.dump_file))
+        for line in dump:
+            type_code, key_json, value_json = line.split('\t', 2)
+            if workers > 1 and zlib.crc32(key_json.encode('utf-8', 'surrogateescape')) % workers != worker:
+                continue
+            key = stdjson.loads(key_json)
+            value = stdjson.loads(value_json)
+            if type_code.isupper():
+                pipeline.delete(key)
+                meter.add(1, 0)
+            _queue_dump_write(pipeline, type_code.lower(), key, value)
+            meter.add(0, len(line))
+            if len(pipeline) >= chunk:
+                pipeline.execute()
+    pipeline.execute()
+    if workers > 1:
+        meter.report()
+    if hasattr(db, 'snapshot') and db.snapshot_file:
+        db.snapshot()
+    return meter.keys, meter.size, meter.start_time
+
+
+class DumpMeter:
+    def __init__(self, label):
+        self.label = label
+        self.keys = 0
+        self.size = 0
+        self.start_time = time.time()
+        self.last_report = self.start_time
+
+    def add(self, keys, size):
+        self.keys += keys
+        self.size += size
+        now = time.time()
+        if now - self.last_report > 10:
+            self.last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = max(time.time() - self.start_time, .001)
+        print("{} {} keys, {:.1f} MB in {:.1f} seconds ({:.0f} keys/s, {:.2f} MB/s)".format(
+            self.label, self.keys, self.size / 1000000, elapsed, self.keys / elapsed, self.size / 1000000 / elapsed))
+
+
+def _open_dump(file_name, mode):
+    # Values are arbitrary bytes, surrogateescape round trips any invalid UTF-8 through the JSON text
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, mode + 't', encoding='utf-8', errors='surrogateescape')
+    return open(file_name, mode, encoding='utf-8', errors='surrogateescape')
+
+
+def _text(value):
+    return value.decode('utf-8', 'surrogateescape')
+
+
+def _binary(value):
+    return value.encode('utf-8', 'surrogateescape')
+
+
+def _dump_line(type_code, key, key_type, value):
+    if key_type == 'string':
+        value = _text(value)
+    elif key_type == 'hash':
+        value = {_text(field): _text(field_value) for field, field_value in value.items()}
+    else:
+        value = [_text(item) for item in value]
+    return '{}\t{}\t{}\n'.format(type_code, stdjson.dumps(key, ensure_ascii=False),
+                                 stdjson.dumps(value, ensure_ascii=False, separators=(',', ':')))
+
+
+def _queue_dump_read(pipeline, key, key_type, chunk):
+    if key_type == 'string':
+        pipeline.get(key)
+    elif key_type == 'set':
+        pipeline.sscan(key, 0, count=chunk)
+    elif key_type == 'hash':
+        pipeline.hscan(key, 0, count=chunk)
+    elif key_type == 'list':
+        pipeline.lrange(key, 0, chunk - 1)
+    else:
+        if key_type != 'none':
+            log.warning("Skipping key %s of unsupported type %s", key, key_type)
+        pipeline.exists(key)
+
+
+def _dump_remainder(db, key, key_type, cursor, chunk):
+    if key_type == 'list':
+        while True:
+            items = db.raw_redis.lrange(key, cursor, cursor + chunk - 1)
+            if items:
+                yield items
+            if len(items) < chunk:
+                return
+            cursor += chunk
+    scan = db.raw_redis.sscan if key_type == 'set' else db.raw_redis.hscan
+    while int(cursor):
+        cursor, items = scan(key, cursor, count=chunk)
+        if items:
+            yield items
+
+
+def _queue_dump_write(pipeline, type_code, key, value):
+    if type_code == 's':
+        pipeline.set(key, _binary(value))
+    elif type_code == 'e':
+        pipeline.sadd(key, *(_binary(item) for item in value))
+    elif type_code == 'h':
+        pipeline.hset(key, mapping={_binary(field): _binary(field_value) for field, field_value in value.items()})
+    elif type_code == 'l':
+        pipeline.rpush(key, *(_binary(item) for item in value))
@@ -3,11 +3,22 @@ def cls_name(cls):
 
 
 def call_mro(obj, func_name, *args, **kwargs):
-    for cls in reversed(obj.__class__.__mro__):
-        try:
-            cls.__dict__[func_name](obj, *args, **kwargs)
-        except KeyError:
-            pass
+    cls = obj.__class__
+    try:
+        hooks = cls.__dict__['_mro_hooks'][func_name]
+    except KeyError:
+        hooks = mro_hooks(cls, func_name)
+    for func in hooks:
+        func(obj, *args, **kwargs)
+
+
+def mro_hooks(cls, func_name):
+    # Classes built by CoreMeta cache the chain, and the cache is cleared when any class attribute changes
+    hooks = tuple(base.__dict__[func_name] for base in reversed(cls.__mro__) if func_name in base.__dict__)
+    hook_cache = cls.__dict__.get('_mro_hooks')
+    if hook_cache is not None:
+        hook_cache[func_name] = hooks
+    return hooks
 
 
 def call_each(coll, func_name, *args, **kwargs):
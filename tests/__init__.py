@@ -0,0 +1,8 @@
+import json
+
+from lampost.di.resource import register
+from lampost.util.logging import LogFactory
+
+register('log', LogFactory())
+register('json_encode', json.JSONEncoder().encode)
+register('json_decode', json.JSONDecoder().decode)
@@ -0,0 +1,61 @@
+import unittest
+
+from lampost.event.dispatcher import PulseDispatcher
+
+
+class PulseDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = PulseDispatcher()
+        self.calls = []
+
+    def callback(self, label='pulse'):
+        self.calls.append((self.dispatcher.current_pulse, label))
+
+    def run_pulses(self, count):
+        for _ in range(count):
+            self.dispatcher.pulse()
+
+    def test_repeat(self):
+        self.dispatcher.register_p(self.callback, pulses=3)
+        self.run_pulses(10)
+        self.assertEqual([pulse for pulse, _ in self.calls], [3, 6, 9])
+
+    def test_once(self):
+        self.dispatcher.register_once(self.callback, pulses=2)
+        self.run_pulses(10)
+        self.assertEqual(self.calls, [(2, 'pulse')])
+        self.assertFalse(self.dispatcher._owner_map)
+        self.assertEqual(len(self.dispatcher._wheel), 0)
+
+    def test_zero_pulses_never_called(self):
+        registrations = [self.dispatcher.register_p(self.callback), self.dispatcher.register_once(self.callback)]
+        self.run_pulses(5)
+        self.assertEqual(self.calls, [])
+        self.assertFalse(self.dispatcher._owner_map)
+        self.assertEqual(len(self.dispatcher._wheel), 0)
+        for registration in registrations:
+            self.assertIsNone(registration.callback)
+
+    def test_priority_order(self):
+        for priority in (5, -1, 2):
+            self.dispatcher.register_p(self.callback, pulses=1, priority=priority,
+                                       kwargs={'label': priority})
+        self.run_pulses(3)
+        self.assertEqual([label for _, label in self.calls], [-1, 2, 5, -1, 2, 5])
+
+    def test_unregister_in_callback(self):
+        later = self.dispatcher.register_p(self.callback, pulses=1, priority=1, kwargs={'label': 'later'})
+
+        def cancel_later():
+            self.callback('first')
+            self.dispatcher.unregister(later)
+
+        self.dispatcher.register_p(cancel_later, pulses=1)
+        self.run_pulses(3)
+        self.assertEqual(self.calls, [(1, 'first'), (2, 'first')])
+        self.assertEqual(len(self.dispatcher._wheel), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
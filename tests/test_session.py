@@ -0,0 +1,89 @@
+import json
+import unittest
+
+from lampost.di.resource import register
+from lampost.event.dispatcher import PulseDispatcher
+
+ev = register('dispatcher', PulseDispatcher())
+
+from lampost.server import session as sm
+from lampost.server.services import PlayerListService
+
+register('session_manager', sm)
+
+
+class StubSocket:
+    def __init__(self):
+        self.messages = []
+
+    def write_message(self, message):
+        self.messages.extend(json.loads(message))
+
+
+class StubPlayer:
+    def __init__(self, dbo_id):
+        self.dbo_id = dbo_id
+        self.name = dbo_id.capitalize()
+        self.location = None
+
+    def display_line(self, *_):
+        pass
+
+    def parse(self, *_):
+        pass
+
+
+class ReconnectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service = PlayerListService()
+        self.service._start()
+        self.session = sm.AppSession().attach()
+        self.session.connect_player(StubPlayer('alice'))
+        sm._session_map['reconnect'] = self.session
+        self.session.attach_socket(StubSocket())
+        self.service.register(self.session)
+        sm.flush_scheduler.flush()
+
+    def tearDown(self):
+        sm.player_info_map().clear()
+        ev.detach_events(self.service)
+        self.session.detach()
+        del sm._session_map['reconnect']
+
+    def update_list(self, player_list):
+        sm.player_info_map().clear()
+        sm.player_info_map().update(player_list)
+        ev.dispatch('player_list', sm.player_info_map())
+
+    def test_pending_delta_dropped_for_snapshot(self):
+        self.update_list({'alice': {'status': 'Active'}})
+        # The socket drops before the delta is flushed, then the list changes again
+        self.session.link_failed('test')
+        player_list = {'alice': {'status': 'Link Dead'}, 'bob': {'status': 'Active'}}
+        self.update_list(player_list)
+
+        sm._reconnect_session('reconnect', 'alice')
+        socket = StubSocket()
+        self.session.attach_socket(socket)
+        sm.flush_scheduler.flush()
+
+        player_lists = [message for message in socket.messages if 'player_list' in message
+                        or 'player_list_delta' in message]
+        self.assertEqual(player_lists, [{'player_list': player_list}])
+
+    def test_pending_delta_kept_without_snapshot(self):
+        self.update_list({'alice': {'status': 'Active'}})
+        self.session.link_failed('test')
+
+        sm._reconnect_session('reconnect', 'alice')
+        socket = StubSocket()
+        self.session.attach_socket(socket)
+        sm.flush_scheduler.flush()
+
+        deltas = [message for message in socket.messages if 'player_list_delta' in message]
+        self.assertEqual(len(deltas), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()